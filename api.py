@@ -0,0 +1,237 @@
+"""
+Headless HTTP API over the analysis pipeline, for batch clients and other
+front-ends. Run with e.g.
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Every request in a process shares one embedding model, one job pool and the
+on-disk caches; processes pointed at the same STUDY_BUDDY_CACHE_DIR serve
+each other's analysed documents.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import tracing
+from cache import EmbeddingCache, LLMResponseCache, ResultCache, SemanticAnswerCache
+from embeddings import load_model
+from jobs import DONE, JobManager
+from pipeline import load_document, run_pipeline
+from vector_index import IndexStore
+
+load_dotenv()
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Analyses running at once per process; each also fans out to the LLM gateway
+API_JOB_WORKERS = int(os.environ.get("STUDY_BUDDY_API_JOB_WORKERS", 4))
+# Documents kept resident for questions; older ones are reloaded from the caches
+API_RESIDENT_DOCUMENTS = int(os.environ.get("STUDY_BUDDY_API_DOCUMENTS", 32))
+MAX_UPLOAD_BYTES = int(os.environ.get("STUDY_BUDDY_API_MAX_UPLOAD_MB", 100)) * 2 ** 20
+
+DOC_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class Question(BaseModel):
+    question: str
+    stream: bool = True
+
+
+class AnalysisService:
+    """
+    Process-wide state behind the API: the shared model and caches, the job
+    pool running analyses, and the most recently used documents.
+    """
+
+    def __init__(self, api_key, embedding_model, reranker=None, label_keywords=False):
+        self.api_key = api_key
+        self.embedding_model = embedding_model
+        self.reranker = reranker
+        self.label_keywords = label_keywords
+        self.index_store = IndexStore()
+        self.result_cache = ResultCache(on_evict=self.index_store.discard)
+        self.response_cache = LLMResponseCache()
+        self.answer_cache = SemanticAnswerCache(
+            threshold=float(os.environ.get("STUDY_BUDDY_ANSWER_THRESHOLD", 0.9))
+        )
+        self.embedding_cache = EmbeddingCache(embedding_model.signature, embedding_model.dim)
+        self.jobs = JobManager(max_workers=API_JOB_WORKERS)
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, pdf_bytes):
+        return self.jobs.submit(
+            run_pipeline,
+            pdf_bytes,
+            api_key=self.api_key,
+            embedding_model=self.embedding_model,
+            embedding_model_name=self.embedding_model.signature,
+            result_cache=self.result_cache,
+            response_cache=self.response_cache,
+            index_store=self.index_store,
+            embedding_cache=self.embedding_cache,
+            reranker=self.reranker,
+            answer_cache=self.answer_cache,
+            label_keywords=self.label_keywords,
+        )
+
+    def remember(self, result):
+        with self._lock:
+            self._documents[result["doc_key"]] = result
+            self._documents.move_to_end(result["doc_key"])
+            while len(self._documents) > API_RESIDENT_DOCUMENTS:
+                self._documents.popitem(last=False)
+
+    def document(self, doc_id):
+        """The analysed document, reloading it from the shared caches if needed; None if unknown."""
+        with self._lock:
+            result = self._documents.get(doc_id)
+            if result is not None:
+                self._documents.move_to_end(doc_id)
+                return result
+        result = load_document(
+            doc_id,
+            api_key=self.api_key,
+            embedding_model=self.embedding_model,
+            result_cache=self.result_cache,
+            response_cache=self.response_cache,
+            index_store=self.index_store,
+            embedding_cache=self.embedding_cache,
+            reranker=self.reranker,
+            answer_cache=self.answer_cache,
+        )
+        if result is not None:
+            self.remember(result)
+        return result
+
+
+def create_service():
+    reranker = None
+    reranker_model = os.environ.get("STUDY_BUDDY_RERANKER")
+    if reranker_model:
+        from sentence_transformers import CrossEncoder
+
+        reranker = CrossEncoder(reranker_model)
+    return AnalysisService(
+        api_key=os.environ.get("GROQ_API_KEY"),
+        # In-process EmbeddingService (STUDY_BUDDY_EMBED_* knobs), or the
+        # shared daemon when STUDY_BUDDY_EMBED_SOCKET is set
+        embedding_model=load_model(EMBEDDING_MODEL),
+        reranker=reranker,
+        label_keywords=os.environ.get("STUDY_BUDDY_KEYWORD_LABELS", "") == "1",
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # The model is loaded once, before the first request is accepted
+    if getattr(app.state, "service", None) is None:
+        app.state.service = await run_in_threadpool(create_service)
+    yield
+
+
+app = FastAPI(title="Study Buddy", lifespan=lifespan)
+
+
+async def _document(doc_id):
+    if not DOC_ID_RE.match(doc_id):
+        raise HTTPException(status_code=404, detail="Unknown document")
+    # Reloading from the caches reads embeddings and the index from disk, so
+    # it stays off the event loop
+    result = await run_in_threadpool(app.state.service.document, doc_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Unknown document")
+    return result
+
+
+@app.post("/documents", status_code=202)
+async def ingest(file: UploadFile = File(...)):
+    """Starts analysing an uploaded PDF; poll /jobs/{job_id} for progress."""
+    pdf_bytes = await file.read(MAX_UPLOAD_BYTES + 1)
+    if not pdf_bytes:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    if len(pdf_bytes) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    job_id = app.state.service.submit(pdf_bytes)
+    return {"job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    service = app.state.service
+    job = service.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    status = {
+        "job_id": job.id,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        # Stages already finished, e.g. keywords long before the summary
+        "stages": sorted(job.outputs),
+        "error": job.error,
+        "doc_id": None,
+    }
+    if job.status == DONE:
+        service.remember(job.result)
+        status["doc_id"] = job.result["doc_key"]
+    return status
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    if app.state.service.jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return {"job_id": job_id, "cancelled": app.state.service.jobs.cancel(job_id)}
+
+
+@app.get("/documents/{doc_id}/summary")
+async def summary(doc_id: str):
+    result = await _document(doc_id)
+    return {"doc_id": doc_id, "summary": result["summary"], "sections": result["summary_parts"]}
+
+
+@app.get("/documents/{doc_id}/keywords")
+async def keywords(doc_id: str):
+    result = await _document(doc_id)
+    return {
+        "doc_id": doc_id,
+        "keywords": [{"keyword": keyword, "weight": weight} for keyword, weight in result["keywords"]],
+    }
+
+
+@app.post("/documents/{doc_id}/ask")
+async def ask(doc_id: str, body: Question):
+    """
+    Answers a question about the document. Streamed as plain text by
+    default; with "stream": false the answer comes back as JSON.
+    """
+    question = body.question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Empty question")
+    qa_system = (await _document(doc_id))["qa_system"]
+
+    if body.stream:
+        # A sync generator: Starlette pulls each piece on its thread pool
+        return StreamingResponse(qa_system.ask_stream(question), media_type="text/plain; charset=utf-8")
+    answer = await run_in_threadpool(qa_system.ask, question)
+    return {"doc_id": doc_id, "answer": answer}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint (see tracing.py)."""
+    return tracing.metrics.prometheus_text()
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
@@ -0,0 +1,228 @@
+"""
+Bulk analysis of a directory (or glob) of PDFs, e.g. a course catalogue
+overnight. Results go to the shared result cache and index store, so the UI
+and API load each document instantly once it has been processed here.
+
+    python batch.py catalogue/ --workers 4 --rpm 30 --tpm 6000
+    python batch.py "catalogue/**/*.pdf" --output-dir out/
+
+Finished files are recorded in a checkpoint file; an interrupted run picks up
+where it stopped when started again with the same arguments.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from cache import DEFAULT_CACHE_DIR, EmbeddingCache, LLMResponseCache, ResultCache
+from embeddings import DEFAULT_MODEL, load_model
+from jobs import DONE, FAILED, JobManager
+from llm_gateway import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE, LLMGateway
+from pipeline import run_pipeline
+from vector_index import IndexStore
+
+DEFAULT_CHECKPOINT = os.path.join(DEFAULT_CACHE_DIR, "batch_checkpoint.json")
+
+
+def find_pdfs(inputs):
+    """Expands directories (recursively) and glob patterns into a sorted list of PDF paths."""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)
+            matches += glob.glob(os.path.join(item, "**", "*.PDF"), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.update(os.path.abspath(path) for path in matches if os.path.isfile(path))
+    return sorted(paths)
+
+
+class Checkpoint:
+    """
+    Files already processed, keyed by path with their size and mtime so an
+    edited file is processed again. Saved atomically after every file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def done(self, path):
+        entry = self.entries.get(path)
+        return entry is not None and entry["stamp"] == self._stamp(path)
+
+    def mark(self, path, doc_key):
+        self.entries[path] = {"stamp": self._stamp(path), "doc_key": doc_key, "finished": time.time()}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+def process_file(job, path, **kwargs):
+    # Read inside the job so only the files being analysed are in memory
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    return run_pipeline(job, pdf_bytes, **kwargs)
+
+
+def write_outputs(output_dir, path, result):
+    # <name>.summary.md and <name>.keywords.json next to each other
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with open(os.path.join(output_dir, f"{stem}.summary.md"), "w", encoding="utf-8") as f:
+        f.write(result["summary"])
+    with open(os.path.join(output_dir, f"{stem}.keywords.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "file": path,
+                "doc_key": result["doc_key"],
+                "keywords": [{"keyword": keyword, "weight": weight} for keyword, weight in result["keywords"]],
+            },
+            f,
+            indent=2,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Directories and/or glob patterns of PDFs.")
+    parser.add_argument("--workers", type=int, default=2, help="Files analysed in parallel.")
+    parser.add_argument("--per-file-requests", type=int, default=2,
+                        help="Summary requests one file may have in flight at once.")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="Groq requests per minute shared by all workers.")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TOKENS_PER_MINUTE,
+                        help="Groq tokens per minute shared by all workers.")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and process every file.")
+    parser.add_argument("--output-dir", help="Also write <name>.summary.md and <name>.keywords.json here.")
+    parser.add_argument("--label-keywords", action="store_true",
+                        default=os.environ.get("STUDY_BUDDY_KEYWORD_LABELS", "") == "1",
+                        help="Name keyword clusters with the LLM (must match the UI setting to share results).")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_key = os.environ.get("GROQ_API_KEY")
+    if not api_key:
+        print("GROQ_API_KEY not found.", file=sys.stderr)
+        return 2
+
+    paths = find_pdfs(args.inputs)
+    checkpoint = Checkpoint(args.checkpoint)
+    pending = [path for path in paths if args.restart or not checkpoint.done(path)]
+    print(f"{len(paths)} PDFs found, {len(paths) - len(pending)} already done, {len(pending)} to process")
+    if not pending:
+        return 0
+
+    # One gateway for the whole run: the rate budget is per API key, so all
+    # workers draw from the same buckets
+    gateway = LLMGateway(
+        api_key=api_key,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        max_concurrency=max(1, args.workers * args.per_file_requests),
+    )
+    embedding_model = load_model(DEFAULT_MODEL)
+    index_store = IndexStore()
+    result_cache = ResultCache(on_evict=index_store.discard)
+    response_cache = LLMResponseCache()
+    embedding_cache = EmbeddingCache(embedding_model.signature, embedding_model.dim)
+
+    # Only a couple of files per worker are queued at a time, and finished
+    # jobs (with their results) are pruned shortly after being collected
+    jobs = JobManager(max_workers=max(1, args.workers), keep_seconds=60)
+    window = 2 * max(1, args.workers)
+    queue = deque(pending)
+    running = {}
+    started = time.perf_counter()
+    totals = {"done": 0, "failed": 0, "cancelled": 0, "bytes": 0, "pages": 0}
+    try:
+        while queue or running:
+            while queue and len(running) < window:
+                path = queue.popleft()
+                job_id = jobs.submit(
+                    process_file,
+                    path,
+                    api_key=api_key,
+                    embedding_model=embedding_model,
+                    embedding_model_name=embedding_model.signature,
+                    result_cache=result_cache,
+                    response_cache=response_cache,
+                    index_store=index_store,
+                    embedding_cache=embedding_cache,
+                    label_keywords=args.label_keywords,
+                    gateway=gateway,
+                    summary_workers=max(1, args.per_file_requests),
+                )
+                running[job_id] = path
+
+            time.sleep(0.2)
+            for job_id, path in list(running.items()):
+                job = jobs.get(job_id)
+                if job is not None and not job.done:
+                    continue
+                del running[job_id]
+                name = os.path.relpath(path)
+                finished = totals["done"] + totals["failed"] + totals["cancelled"] + 1
+                if job is None:
+                    # Pruned before it was collected; it runs again next time
+                    totals["failed"] += 1
+                    print(f"[{finished}/{len(pending)}] LOST {name}")
+                elif job.status == DONE:
+                    result = job.result
+                    checkpoint.mark(path, result["doc_key"])
+                    if args.output_dir:
+                        write_outputs(args.output_dir, path, result)
+                    totals["done"] += 1
+                    totals["bytes"] += os.path.getsize(path)
+                    # Documents served from the result cache never read their pages
+                    totals["pages"] += len(job.outputs.get("pages", ()))
+                    print(f"[{finished}/{len(pending)}] OK {name}")
+                elif job.status == FAILED:
+                    totals["failed"] += 1
+                    print(f"[{finished}/{len(pending)}] FAILED {name}: {job.error}")
+                else:
+                    totals["cancelled"] += 1
+                    print(f"[{finished}/{len(pending)}] CANCELLED {name}")
+    except KeyboardInterrupt:
+        # Finished files are already checkpointed; the rest run again next time
+        print("Interrupted, cancelling remaining files...")
+        for job_id in running:
+            jobs.cancel(job_id)
+        totals["cancelled"] += len(running) + len(queue)
+
+    elapsed = time.perf_counter() - started
+    stats = gateway.stats
+    cache_stats = embedding_cache.stats()
+    print()
+    print(f"Files:       {totals['done']} done, {totals['failed']} failed, {totals['cancelled']} cancelled")
+    print(f"Elapsed:     {elapsed:.1f} s")
+    print(f"Throughput:  {totals['done'] / elapsed * 60:.2f} files/min, "
+          f"{totals['pages'] / elapsed:.1f} pages/s, {totals['bytes'] / elapsed / 2**20:.2f} MB/s")
+    print(f"Groq:        {stats['requests']} requests, {stats['retries']} retries "
+          f"({stats['rate_limited']} rate limited), {stats['queue_wait']:.1f} s queued")
+    print(f"Embeddings:  {cache_stats['hit_rate']:.0%} cache hits")
+    return 1 if totals["failed"] or totals["cancelled"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,412 @@
+"""
+Offline benchmark of the upload pipeline and question answering.
+
+Generates PDFs of increasing size, replaces Groq with FakeGroqClient
+(configurable latency, jitter, token throughput and injected 429s) and
+reports per-stage latency percentiles, throughput, peak RSS and LLM
+request counts as JSON. Every stage runs in a fresh process, so its peak
+RSS covers only the stage and the inputs it is given.
+
+    python benchmark.py --sizes 10,100,500,2000 --output bench.json
+    python benchmark.py --sizes 10,100 --baseline bench.json   # exit 1 on regressions
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from types import SimpleNamespace
+
+import numpy as np
+
+from chunker import estimate_tokens
+from keywords import ConceptExtractor
+from llm_gateway import LLMGateway
+from pdf_reader import extract_text_from_pdf
+from qa import SemanticQA
+from summarizer import PART_MARKER_RE, SemanticSummarizer
+
+WORDS = (
+    "algorithm matrix gradient entropy protocol kernel cache latency vector tensor network graph "
+    "theorem lemma integral derivative probability variance regression classifier compiler parser "
+    "thread process memory schedule database index query transaction replication consensus"
+).split()
+FILLER = "the a of and to in is for that with as on by this are from which can be".split()
+
+QUESTIONS = [
+    "What is the main idea of chapter 3?",
+    "Explain how gradient and entropy are related.",
+    "Which protocol is described for replication?",
+    "Summarize the theorem about variance.",
+    "What does the text say about cache latency?",
+]
+
+
+# --- Generated documents ---
+
+def _sentence(rng):
+    words = [rng.choice(WORDS if rng.random() < 0.4 else FILLER) for _ in range(rng.randint(8, 16))]
+    return " ".join(words).capitalize() + "."
+
+
+def generate_pdf(pages, seed=0, lines_per_page=40):
+    """Returns the bytes of a text PDF with `pages` pages of study-like prose."""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for page in range(pages):
+        lines = []
+        if page % 10 == 0:
+            lines.append(f"Chapter {page // 10 + 1}: {rng.choice(WORDS).title()} and {rng.choice(WORDS).title()}")
+        while len(lines) < lines_per_page:
+            lines.append(_sentence(rng))
+        text = " T* ".join(
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj" for line in lines
+        )
+        stream = f"BT /F1 9 Tf 14 TL 40 760 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in page_ids), pages
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+# --- Groq stand-in ---
+
+class FakeRateLimitError(Exception):
+    """Looks like a groq 429 to LLMGateway (status_code and a Retry-After header)."""
+
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("Rate limit reached (injected)")
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class FakeGroqClient:
+    """
+    Drop-in for groq.Groq in LLMGateway(client=...). Every completion waits
+    latency (+/- jitter) before the first token, then streams the reply at
+    tokens_per_second; a fraction rate_limit_rate of calls fails with 429.
+    """
+
+    def __init__(self, latency=0.1, jitter=0.02, tokens_per_second=2000, rate_limit_rate=0.0, retry_after=0.05, seed=0):
+        self.chat = SimpleNamespace(completions=self)
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stats = {"requests": 0, "rate_limited": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create(self, messages, model, stream=False, **kwargs):
+        with self._lock:
+            self.stats["requests"] += 1
+            limited = self._rng.random() < self.rate_limit_rate
+            first_token = max(0.0, self._rng.gauss(self.latency, self.jitter))
+            if limited:
+                self.stats["rate_limited"] += 1
+        if limited:
+            time.sleep(first_token / 4)
+            raise FakeRateLimitError(self.retry_after)
+
+        content = _fake_reply(messages)
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        with self._lock:
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        generation = completion_tokens / self.tokens_per_second
+
+        if not stream:
+            time.sleep(first_token + generation)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+        return self._stream(content, first_token, generation, usage)
+
+    @staticmethod
+    def _stream(content, first_token, generation, usage):
+        time.sleep(first_token)
+        pieces = [content[i:i + 32] for i in range(0, len(content), 32)]
+        for piece in pieces:
+            time.sleep(generation / len(pieces))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], x_groq=None)
+        yield SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=usage))
+
+
+def _fake_reply(messages):
+    system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+    user = messages[-1]["content"]
+    topic = " ".join(re.findall(r"[a-z]{5,}", user.lower())[:3]) or "content"
+
+    parts = PART_MARKER_RE.findall(user)
+    if parts:
+        return "\n".join(f"=== PART {n} ===\n## {topic.title()} {n}\n- Fact about {topic}.\n- Detail." for n in parts)
+    if "comma-separated list" in user:
+        return ", ".join(sorted(set(re.findall(r"[a-z]{6,}", user.lower())))[:8])
+    if "numbered line" in user:
+        return "\n".join(f"{n}. Topic {n}" for n in range(1, user.count("\n") + 1))
+    if "Context Segments" in user:
+        return f"The text explains {topic} in detail. " * 4
+    if system:
+        return f"## {topic.title()}\n- Key fact about {topic}.\n- Another fact about {topic}.\n- Definition."
+    return topic
+
+
+class HashEmbedder:
+    """
+    Deterministic hashing-trick embedder, for runs without the MiniLM model.
+    Tokens are bucketed with crc32 rather than hash(), which is salted per
+    process, so every stage process and every run embeds alike.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def encode(self, texts, convert_to_tensor=False):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in re.findall(r"\w+", text.lower()):
+                out[row, zlib.crc32(token.encode("utf-8")) % self.dim] += 1.0
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-9)
+        return out
+
+
+# --- Measurement ---
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def measure(fn, runs, units, gateway, client):
+    """
+    Runs fn `runs` times and returns (last result, stage report). units is
+    the amount of work per run (pages, questions...) for throughput.
+    """
+    gateway_before = dict(gateway.stats)
+    client_before = dict(client.stats)
+    samples = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+
+    ms = np.array(samples) * 1000
+    report = {
+        "runs": runs,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "throughput_per_s": units * runs / max(sum(samples), 1e-9),
+    }
+    report.update({
+        f"llm_{name}": gateway.stats[name] - gateway_before[name]
+        for name in ("requests", "retries", "rate_limited", "failures")
+    })
+    report.update({
+        f"llm_{name}": client.stats[name] - client_before[name]
+        for name in ("prompt_tokens", "completion_tokens")
+    })
+    return result, report
+
+
+STAGES = ("extract_text", "summarize", "extract_keywords", "prepare_context", "ask")
+
+
+def _load_model(args):
+    if args.hash_embeddings:
+        return HashEmbedder()
+    from embeddings import load_model
+    return load_model()
+
+
+def run_stage(stage, pages, data, config):
+    """
+    Runs one stage `runs` times in this process and returns (output for
+    the next stages, stage report, fake client stats). Called in a fresh
+    process per stage, see benchmark_document.
+
+    Args:
+        stage (str): One of STAGES.
+        pages (int): Page count of the document, for throughput.
+        data: The stage's input: PDF bytes for extract_text, the summary for
+            extract_keywords and the extracted text otherwise.
+        config (dict): The parsed command line arguments.
+    """
+    args = argparse.Namespace(**config)
+    client = FakeGroqClient(
+        latency=args.latency, jitter=args.jitter, tokens_per_second=args.tokens_per_second,
+        rate_limit_rate=args.rate_limit_rate, seed=args.seed,
+    )
+    gateway = LLMGateway(
+        client=client, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+        base_delay=0.05, max_delay=1.0,
+    )
+
+    if stage == "extract_text":
+        output, report = measure(lambda: extract_text_from_pdf(io.BytesIO(data)), args.runs, pages, gateway, client)
+    elif stage == "summarize":
+        summarizer = SemanticSummarizer(None, gateway=gateway)
+        output, report = measure(lambda: summarizer.summarize(data), args.runs, pages, gateway, client)
+    elif stage == "extract_keywords":
+        extractor = ConceptExtractor(None, gateway=gateway)
+        _, report = measure(lambda: extractor.extract_keywords(data), args.runs, 1, gateway, client)
+        output = None
+    elif stage == "prepare_context":
+        qa = SemanticQA(_load_model(args), None, gateway=gateway)
+        _, report = measure(lambda: qa.prepare_context(data), args.runs, pages, gateway, client)
+        output = len(qa.context_chunks)
+    else:
+        # Not measured: the index is this stage's input
+        qa = SemanticQA(_load_model(args), None, gateway=gateway)
+        qa.prepare_context(data)
+        questions = [QUESTIONS[i % len(QUESTIONS)] + f" ({i})" for i in range(args.questions)]
+        ttft = []
+
+        def ask_all():
+            for question in questions:
+                for _ in qa.ask_stream(question):
+                    pass
+                ttft.append(qa.last_timing["ttft"] * 1000)
+
+        _, report = measure(ask_all, args.runs, len(questions), gateway, client)
+        report["ttft_p50_ms"] = float(np.percentile(ttft, 50))
+        report["ttft_p95_ms"] = float(np.percentile(ttft, 95))
+        report["retrieval_ms"] = qa.last_retrieval_ms
+        output = None
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    return output, report, dict(client.stats)
+
+
+def benchmark_document(pages, args, llm_totals):
+    pdf = generate_pdf(pages, seed=args.seed)
+    doc = {"pages": pages, "pdf_bytes": len(pdf), "stages": {}}
+    inputs = {"extract_text": pdf}
+    config = vars(args)
+
+    for stage in STAGES:
+        if stage == "extract_keywords":
+            data = inputs["summarize"]
+        elif stage == "extract_text":
+            data = pdf
+        else:
+            data = inputs["extract_text"]
+        # ru_maxrss only ever grows, so a process shared by all stages would
+        # report the largest stage so far for every later one
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            output, doc["stages"][stage], client_stats = executor.submit(
+                run_stage, stage, pages, data, config
+            ).result()
+        inputs[stage] = output
+        for name, value in client_stats.items():
+            llm_totals[name] = llm_totals.get(name, 0) + value
+
+    doc["chunks"] = inputs["prepare_context"]
+    return doc
+
+
+def compare(baseline, current, tolerance):
+    """Lists stages whose p95 grew by more than `tolerance` (fraction) against the baseline."""
+    before = {(d["pages"], name): s for d in baseline["documents"] for name, s in d["stages"].items()}
+    regressions = []
+    for doc in current["documents"]:
+        for name, stage in doc["stages"].items():
+            old = before.get((doc["pages"], name))
+            if old and old["p95_ms"] > 0 and stage["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append({
+                    "pages": doc["pages"], "stage": name,
+                    "baseline_p95_ms": old["p95_ms"], "p95_ms": stage["p95_ms"],
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,500,2000", help="Comma-separated page counts.")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions of every stage.")
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.1, help="Fake LLM time to first token (s).")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Standard deviation of that latency (s).")
+    parser.add_argument("--tokens-per-second", type=float, default=2000)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls failing with 429.")
+    parser.add_argument("--rpm", type=int, default=100000, help="Gateway requests-per-minute budget.")
+    parser.add_argument("--tpm", type=int, default=10 ** 9, help="Gateway tokens-per-minute budget.")
+    parser.add_argument("--hash-embeddings", action="store_true",
+                        help="Use HashEmbedder instead of loading all-MiniLM-L6-v2.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--baseline", help="Earlier report; exit 1 if any stage's p95 regressed.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    report = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "documents": [],
+    }
+    llm_totals = {}
+    for pages in (int(size) for size in args.sizes.split(",") if size.strip()):
+        report["documents"].append(benchmark_document(pages, args, llm_totals))
+    report["llm_totals"] = llm_totals
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(json.load(f), report, args.tolerance)
+        failed = bool(report["regressions"])
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import math
+import re
+from array import array
+
+import numpy as np
+
+from vector_index import top_k
+
+# Keeps codes and formula names whole: "cs-101", "h2o", "f1.5", "tf_idf"
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index. Postings are compact typed arrays
+    (chunk id, term frequency) per term, so the index is a small fraction
+    of the embedding matrix, and add() extends it without a rebuild.
+    """
+
+    def __init__(self, texts=(), k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._lengths = array("I")
+        self._total_length = 0
+        self.add(texts)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, texts):
+        """Indexes texts; they receive the next consecutive ids."""
+        for text in texts:
+            doc_id = len(self._lengths)
+            counts = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = (array("I"), array("H"))
+                postings[0].append(doc_id)
+                postings[1].append(min(tf, 65535))
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._total_length += length
+
+    def scores(self, query):
+        """BM25 score of every indexed text against query (0 where no term matches)."""
+        n = len(self._lengths)
+        scores = np.zeros(n, dtype=np.float32)
+        if not n:
+            return scores
+        lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(self._total_length / n, 1e-9))
+
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            ids = np.frombuffer(postings[0], dtype=np.uint32)
+            tf = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm[ids])
+        return scores
+
+    def search(self, query, k, mask=None):
+        """Returns (ids, scores) of the k best matching texts; texts sharing no term are left out."""
+        scores = self.scores(query)
+        if mask is not None:
+            scores = np.where(mask, scores, 0)
+        ids = top_k(scores, k)
+        ids = ids[scores[ids] > 0]
+        return ids, scores[ids]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merges ranked id lists: each id scores sum(1 / (k + rank)) over the
+    lists it appears in. Returns ids best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            doc_id = int(doc_id)
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
@@ -0,0 +1,469 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get("STUDY_BUDDY_CACHE_DIR", ".study_buddy_cache")
+
+
+def document_key(pdf_bytes, model, prompt_version):
+    """
+    Builds the content address for one analysed document.
+
+    Args:
+        pdf_bytes (bytes): Raw bytes of the uploaded PDF.
+        model (str): Model name(s) the results were produced with.
+        prompt_version (str): Version tag of the prompts in use.
+
+    Returns:
+        str: Hex digest identifying the document + pipeline configuration.
+    """
+    digest = hashlib.sha256()
+    digest.update(pdf_bytes)
+    digest.update(b"\0" + str(model).encode("utf-8"))
+    digest.update(b"\0" + str(prompt_version).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def evict_lru(directory, max_bytes):
+    """
+    Deletes the least recently used entry directories under `directory`
+    (by modification time) until their total size is at most max_bytes.
+
+    Returns:
+        list: Names of the deleted entries.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        size = sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+        entries.append((os.stat(path).st_mtime, size, name))
+        total += size
+
+    # Oldest access time first
+    evicted = []
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        evicted.append(name)
+        total -= size
+    return evicted
+
+
+class ResultCache:
+    """
+    On-disk cache of full pipeline results, shared by every session and
+    surviving restarts. Each entry is a directory holding the JSON results
+    and the chunk embeddings; the least recently used entries are evicted
+    once the total size exceeds max_bytes.
+
+    on_evict, if given, is called with the key of every evicted entry, e.g.
+    IndexStore.discard so a document's index goes with its results.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=512 * 1024 * 1024, on_evict=None):
+        self.directory = os.path.join(directory, "results")
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key):
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, "result.json"), encoding="utf-8") as f:
+                result = json.load(f)
+            result["embeddings"] = np.load(os.path.join(entry, "embeddings.npy"))
+        except (OSError, ValueError):
+            return None
+
+        # Touch the entry so eviction sees it as recently used; it may have
+        # been evicted since it was read
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, text, chunk_summaries, keywords, chunks, embeddings, chunk_hashes=None, summary=None):
+        payload = {
+            "text": text,
+            # The reduced summary, so a hit never has to merge chunk summaries again
+            "summary": summary,
+            "chunk_summaries": list(chunk_summaries),
+            "chunk_hashes": list(chunk_hashes or []),
+            "keywords": list(keywords),
+            "chunks": list(chunks),
+        }
+
+        # Write into a scratch directory first so readers never see half an entry
+        tmp = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        try:
+            with open(os.path.join(tmp, "result.json"), "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            np.save(os.path.join(tmp, "embeddings.npy"), np.asarray(embeddings, dtype=np.float32))
+
+            entry = os.path.join(self.directory, key)
+            with self._lock:
+                shutil.rmtree(entry, ignore_errors=True)
+                os.replace(tmp, entry)
+                self._evict()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _evict(self):
+        for key in evict_lru(self.directory, self.max_bytes):
+            if self.on_evict is not None:
+                self.on_evict(key)
+
+
+class LLMResponseCache:
+    """
+    Two-tier memo for chat completions: a small in-process LRU in front of a
+    SQLite table shared by every process on the host. Entries expire after
+    ttl seconds and the table is trimmed to max_rows, least recently used
+    first.
+    """
+
+    def __init__(self, path=None, memory_entries=1024, max_rows=50000, ttl=7 * 24 * 3600):
+        if path is None:
+            os.makedirs(DEFAULT_CACHE_DIR, exist_ok=True)
+            path = os.path.join(DEFAULT_CACHE_DIR, "llm_responses.sqlite3")
+        self.memory_entries = memory_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(model, system_prompt, temperature, user_content):
+        system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        user_hash = hashlib.sha256(user_content.encode("utf-8")).hexdigest()
+        return f"{model}:{system_hash}:{float(temperature)}:{user_hash}"
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry[0]
+
+            row = self._db.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+
+            # Trimming on every write would dominate, so only do it periodically
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+            self._db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+class EmbeddingCache:
+    """
+    Persistent chunk embeddings for one model, keyed by the chunk's
+    normalized text hash (chunker.chunk_hash), so repeated paragraphs are
+    encoded once across documents, versions and users.
+
+    Vectors are stored as float16 rows of a memory-mapped file; a SQLite
+    table maps each hash to its row. Once more than max_entries rows are in
+    use, the least recently used are dropped and their rows reused.
+
+    Several processes may share the directory: rows are handed out and
+    read under SQLite's write lock, and the next row and the free rows are
+    kept in the database rather than in each process.
+    """
+
+    def __init__(self, model, dim, directory=DEFAULT_CACHE_DIR, max_entries=200000):
+        model_hash = hashlib.sha256(str(model).encode("utf-8")).hexdigest()[:16]
+        self.directory = os.path.join(directory, "embeddings", model_hash)
+        self.dim = dim
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Autocommit, so the transactions below are the only ones
+        self._db = sqlite3.connect(
+            os.path.join(self.directory, "index.sqlite3"), timeout=60, isolation_level=None,
+            check_same_thread=False,
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, slot INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS slots (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+        with self._transaction():
+            row = self._db.execute("SELECT value FROM slots WHERE name = 'next'").fetchone()
+            if row is None:
+                # Directory written before the slot tables existed
+                used = {slot for (slot,) in self._db.execute("SELECT slot FROM embeddings")}
+                next_slot = max(used) + 1 if used else 0
+                self._db.execute("INSERT INTO slots (name, value) VALUES ('next', ?)", (next_slot,))
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO free_slots (slot) VALUES (?)",
+                    [(slot,) for slot in range(next_slot) if slot not in used],
+                )
+            else:
+                next_slot = row[0]
+            self._path = os.path.join(self.directory, "vectors.f16")
+            self._vectors = None
+            self._open(max(next_slot, 1024))
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the database write lock up front, so slot
+        # bookkeeping is serialized across processes
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _open(self, rows):
+        # Grows the backing file to at least `rows` rows and maps all of it.
+        # Only called inside a write transaction, so one process grows it at a time
+        size = rows * self.dim * 2
+        with open(self._path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        capacity = os.path.getsize(self._path) // (self.dim * 2)
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._vectors = np.memmap(self._path, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+
+    def _ensure(self, slot):
+        # Another process may have grown the file past this process's map
+        if slot >= len(self._vectors):
+            self._open(max(slot + 1, 2 * len(self._vectors)))
+
+    def _take_slot(self):
+        row = self._db.execute("SELECT MIN(slot) FROM free_slots").fetchone()
+        if row[0] is not None:
+            self._db.execute("DELETE FROM free_slots WHERE slot = ?", (row[0],))
+            return row[0]
+        (slot,) = self._db.execute("SELECT value FROM slots WHERE name = 'next'").fetchone()
+        self._db.execute("UPDATE slots SET value = ? WHERE name = 'next'", (slot + 1,))
+        return slot
+
+    def get_many(self, keys):
+        """Returns a float32 vector, or None on a miss, for each key."""
+        keys = list(keys)
+        found = {}
+        # Rows are read inside the transaction so no other process can evict
+        # and reuse them in between
+        with self._lock, self._transaction():
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, slot FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE embeddings SET accessed = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._ensure(max(found.values()))
+            results = [
+                np.array(self._vectors[found[key]], dtype=np.float32) if key in found else None
+                for key in keys
+            ]
+            missing = sum(1 for result in results if result is None)
+            self.hits += len(keys) - missing
+            self.misses += missing
+        return results
+
+    def put_many(self, keys, vectors):
+        now = time.time()
+        with self._lock, self._transaction():
+            rows = []
+            for key, vector in zip(keys, vectors):
+                row = self._db.execute("SELECT slot FROM embeddings WHERE key = ?", (key,)).fetchone()
+                slot = row[0] if row is not None else self._take_slot()
+                self._ensure(slot)
+                self._vectors[slot] = np.asarray(vector, dtype=np.float16)
+                rows.append((key, slot, now))
+            # Vectors reach the file before their rows become visible
+            self._vectors.flush()
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, slot, accessed) VALUES (?, ?, ?)", rows)
+
+            (count,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                # Trim to 90% so eviction doesn't run on every put
+                evicted = self._db.execute(
+                    "SELECT key, slot FROM embeddings ORDER BY accessed ASC LIMIT ?",
+                    (count - int(self.max_entries * 0.9),),
+                ).fetchall()
+                self._db.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key, _ in evicted])
+                self._db.executemany("INSERT OR IGNORE INTO free_slots (slot) VALUES (?)",
+                                     [(slot,) for _, slot in evicted])
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            # float32 vectors served without running the model
+            "bytes_saved": self.hits * self.dim * 4,
+            "entries": entries,
+            "disk_bytes": entries * self.dim * 2,
+        }
+
+
+class SemanticAnswerCache:
+    """
+    In-process cache of answers by question meaning. An answer is reused
+    when a new question's embedding has cosine similarity of at least
+    `threshold` with a cached one and retrieval picked exactly the same
+    chunks, so paraphrases of a popular question cost one completion.
+
+    Entries live under a context key (see SemanticQA.context_version): a
+    changed index gets a new key, and invalidate() drops a key explicitly.
+    Both the contexts and the entries within each are LRU-bounded and
+    entries expire after ttl seconds.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=512, max_contexts=64, ttl=24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_contexts = max_contexts
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, context_key, query_vector, chunk_ids):
+        chunk_ids = tuple(int(i) for i in chunk_ids)
+        now = time.time()
+        with self._lock:
+            entries = self._contexts.get(context_key)
+            if entries:
+                for entry_id in [e for e, entry in entries.items() if now - entry[3] >= self.ttl]:
+                    del entries[entry_id]
+                candidates = [(e, entry) for e, entry in entries.items() if entry[1] == chunk_ids]
+                if candidates:
+                    vectors = np.stack([entry[0] for _, entry in candidates])
+                    similarity = vectors @ self._unit(query_vector)
+                    best = int(np.argmax(similarity))
+                    if similarity[best] >= self.threshold:
+                        entry_id, entry = candidates[best]
+                        entries.move_to_end(entry_id)
+                        self._contexts.move_to_end(context_key)
+                        self.hits += 1
+                        return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, context_key, query_vector, chunk_ids, answer):
+        with self._lock:
+            entries = self._contexts.get(context_key)
+            if entries is None:
+                entries = self._contexts[context_key] = OrderedDict()
+                while len(self._contexts) > self.max_contexts:
+                    self._contexts.popitem(last=False)
+            self._contexts.move_to_end(context_key)
+            entries[uuid.uuid4().hex] = (
+                self._unit(query_vector), tuple(int(i) for i in chunk_ids), answer, time.time()
+            )
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, context_key=None):
+        """Drops the entries of one context, or of all contexts."""
+        with self._lock:
+            if context_key is None:
+                self._contexts.clear()
+            else:
+                self._contexts.pop(context_key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "contexts": len(self._contexts),
+        }
@@ -0,0 +1,200 @@
+import hashlib
+import re
+import time
+
+import tracing
+
+# Roughly 4 characters per token for English text with Llama/MiniLM tokenizers
+CHARS_PER_TOKEN = 4
+
+# A line on its own that looks like a title: markdown heading, "Chapter 3 ...",
+# "2.1 Some Title" or an ALL-CAPS line
+HEADING_RE = re.compile(
+    r"^[ \t]*(?:"
+    r"#{1,6}[ \t]+\S[^\n]*"
+    r"|(?i:chapter|section|module|unit|part|lecture)[ \t]+[\w.]+[^\n]*"
+    r"|\d+(?:\.\d+)*\.?[ \t]+[A-Z][^.!?\n]*"
+    r"|[A-Z][A-Z0-9 ,:&()/-]{3,}"
+    r")[ \t]*$",
+    re.MULTILINE,
+)
+MAX_HEADING_CHARS = 100
+
+# End of a sentence, or a blank line between paragraphs
+SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*(?=\s)|\n[ \t]*\n")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def chunk_hash(text):
+    """Content hash of a chunk, insensitive to whitespace differences."""
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def chunk_text(text, max_tokens=450, overlap_tokens=0):
+    """Chunks a single string; see iter_chunks."""
+    return list(iter_chunks([{"page": 1, "text": text, "start": 0}], max_tokens, overlap_tokens))
+
+
+def iter_chunks(pages, max_tokens=450, overlap_tokens=0, page_aligned=False):
+    """
+    Splits a stream of page records into chunks of at most max_tokens,
+    cutting at sentence and paragraph ends and starting a new chunk at each
+    heading. Runs in one pass; chunk text is sliced from the page text, never
+    built up by repeated concatenation.
+
+    Args:
+        pages: Page records ({"page", "text", "start"}) as yielded by
+            pdf_reader.iter_pdf_pages.
+        max_tokens (int): Size limit per chunk (estimated tokens).
+        overlap_tokens (int): Trailing sentences of a chunk, up to this many
+            tokens, are repeated at the start of the next one.
+        page_aligned (bool): Never let a chunk span two pages. An edit to one
+            page then leaves every other page's chunks (and their hashes)
+            unchanged.
+
+    Yields:
+        dict: {"text", "tokens", "page", "end_page", "start", "end"}; start
+        and end are character offsets in the whole document.
+    """
+    max_tokens = max(1, max_tokens)
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    max_chars = max(1, max_tokens - 1) * CHARS_PER_TOKEN
+
+    current = []
+    current_tokens = 0
+    carried = 0  # leading units of `current` repeated from the previous chunk
+
+    # Chunking is interleaved with reading pages and consuming chunks: the
+    # span's duration is only the time spent in here, wall_s how long the
+    # stream was open
+    span = tracing.tracer.start("chunking", max_tokens=max_tokens)
+    opened = time.perf_counter()
+    busy = 0.0
+    page_count = chunk_count = 0
+
+    try:
+        for record in pages:
+            resumed = time.perf_counter()
+            page_count += 1
+            text = record["text"]
+            if page_aligned and current:
+                if len(current) > carried:
+                    chunk = _make_chunk(current)
+                    busy += time.perf_counter() - resumed
+                    chunk_count += 1
+                    yield chunk
+                    resumed = time.perf_counter()
+                current, current_tokens, carried = [], 0, 0
+
+            for start, end, heading in _units(text):
+                for piece_start, piece_end in _split_long(text, start, end, max_chars):
+                    # +1 for the separator the unit is joined with
+                    tokens = estimate_tokens(text[piece_start:piece_end]) + 1
+                    too_big = current_tokens + tokens > max_tokens
+                    new_section = heading and current_tokens >= max_tokens // 4
+
+                    if len(current) > carried and (too_big or new_section):
+                        chunk = _make_chunk(current)
+                        busy += time.perf_counter() - resumed
+                        chunk_count += 1
+                        yield chunk
+                        resumed = time.perf_counter()
+                        current = [] if new_section else _tail(current, overlap_tokens)
+                        current_tokens = sum(unit[5] for unit in current)
+                        carried = len(current)
+                    if current and current_tokens + tokens > max_tokens:
+                        # The carried overlap does not fit alongside this unit
+                        current, current_tokens, carried = [], 0, 0
+
+                    current.append((text, piece_start, piece_end, record["page"], record["start"], tokens))
+                    current_tokens += tokens
+                    heading = False
+            busy += time.perf_counter() - resumed
+        resumed = time.perf_counter()
+        if len(current) > carried:
+            chunk = _make_chunk(current)
+            busy += time.perf_counter() - resumed
+            chunk_count += 1
+            yield chunk
+
+    finally:
+        ended = time.time_ns()
+        span.start_ns = ended - int(busy * 1e9)
+        span.set(wall_s=time.perf_counter() - opened, pages=page_count, chunks=chunk_count)
+        span.end(end_ns=ended)
+        tracing.metrics.observe("chunking_busy_seconds", busy)
+
+def _units(text):
+    # Cut points: sentence/paragraph ends plus both edges of every heading line
+    cuts = {0, len(text)}
+    headings = set()
+    for match in HEADING_RE.finditer(text):
+        if match.end() - match.start() <= MAX_HEADING_CHARS:
+            cuts.add(match.start())
+            cuts.add(match.end())
+            headings.add(match.start())
+    for match in SENTENCE_END_RE.finditer(text):
+        cuts.add(match.end())
+
+    cuts = sorted(cuts)
+    for start, end in zip(cuts, cuts[1:]):
+        heading = start in headings
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            yield start, end, heading
+
+
+def _split_long(text, start, end, max_chars):
+    # A single sentence longer than a chunk is cut at whitespace
+    while end - start > max_chars:
+        cut = text.rfind(" ", start + max_chars // 2, start + max_chars)
+        if cut == -1:
+            cut = start + max_chars
+        yield start, cut
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        yield start, end
+
+
+def _tail(units, overlap_tokens):
+    tail = []
+    tokens = 0
+    for unit in reversed(units):
+        if tokens + unit[5] > overlap_tokens:
+            break
+        tail.append(unit)
+        tokens += unit[5]
+    tail.reverse()
+    return tail
+
+
+def _make_chunk(units):
+    # Consecutive units from the same page are one slice of that page's text
+    parts = []
+    text, start, end, page = units[0][0], units[0][1], units[0][2], units[0][3]
+    for unit in units[1:]:
+        if unit[3] == page:
+            end = unit[2]
+        else:
+            parts.append(text[start:end])
+            text, start, end, page = unit[0], unit[1], unit[2], unit[3]
+    parts.append(text[start:end])
+
+    first, last = units[0], units[-1]
+    chunk = "\n".join(parts)
+    return {
+        "text": chunk,
+        "tokens": estimate_tokens(chunk),
+        "page": first[3],
+        "end_page": last[3],
+        "start": first[4] + first[1],
+        "end": last[4] + last[2],
+    }
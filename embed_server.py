@@ -0,0 +1,342 @@
+"""
+Embedding daemon: one process owns the MiniLM model and serves every
+Streamlit/API/batch process on the machine over a Unix socket.
+
+    python embed_server.py --socket /run/study-buddy/embed.sock
+    STUDY_BUDDY_EMBED_SOCKET=/run/study-buddy/embed.sock streamlit run ui.py
+
+Requests from all clients are merged into shared forward passes. Vectors
+never cross the socket: each client connection owns a shared memory
+segment, the daemon copies the float32 rows into it and replies with the
+row count. This is not zero-copy: the client copies the rows out again so
+the segment can be reused by the connection's next call, i.e. two memory
+copies per call instead of JSON encoding.
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from embeddings import DEFAULT_MODEL, DEFAULT_SOCKET, EmbeddingService
+
+FALLBACK_SOCKET = "/tmp/study-buddy-embed.sock"
+# Connections (each with a shared buffer) a client process keeps to the daemon
+DEFAULT_CONNECTIONS = int(os.environ.get("STUDY_BUDDY_EMBED_CONNECTIONS", 8))
+
+_HEADER = struct.Struct("!I")
+
+
+def _send(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv(stream):
+    # Returns None once the peer has closed the connection
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    data = stream.read(_HEADER.unpack(header)[0])
+    return json.loads(data.decode("utf-8"))
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Otherwise this process would unlink the client's segment on exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _Request:
+    __slots__ = ("texts", "vectors", "error", "ready")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.vectors = None
+        self.error = None
+        self.ready = threading.Event()
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves `model` (an EmbeddingService) on a Unix socket. One thread per
+    client connection; a single batcher thread runs the model, taking every
+    request that arrives within wait_ms of the first, up to max_batch texts.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, model, socket_path, max_batch=256, wait_ms=5):
+        self.model = model
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000.0
+        self.stats = {"requests": 0, "texts": 0, "batches": 0}
+        self._requests = queue.Queue()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # left behind by a previous run
+        super().__init__(socket_path, _ConnectionHandler)
+        os.chmod(socket_path, 0o600)
+        threading.Thread(target=self._batch_loop, name="embed-batcher", daemon=True).start()
+
+    def encode(self, texts):
+        """Queues texts for the next shared forward pass and waits for their vectors."""
+        request = _Request(texts)
+        self._requests.put(request)
+        request.ready.wait()
+        if request.error is not None:
+            raise request.error
+        return request.vectors
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._requests.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            self.stats["requests"] += len(batch)
+            self.stats["texts"] += size
+            self.stats["batches"] += 1
+            try:
+                vectors = self.model.encode([text for request in batch for text in request.texts])
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.ready.set()
+                continue
+            start = 0
+            for request in batch:
+                request.vectors = vectors[start:start + len(request.texts)]
+                start += len(request.texts)
+                request.ready.set()
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        segments = {}
+        try:
+            while True:
+                message = _recv(self.rfile)
+                if message is None:
+                    return
+                try:
+                    reply = self._dispatch(message, segments)
+                except Exception as e:
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+                _send(self.connection, reply)
+        finally:
+            for shm in segments.values():
+                shm.close()
+
+    def _dispatch(self, message, segments):
+        model = self.server.model
+        if message["op"] == "info":
+            return {"name": model.name, "dim": model.dim, "signature": model.signature}
+        if message["op"] != "encode":
+            raise ValueError(f"Unknown op: {message['op']}")
+
+        texts = message["texts"]
+        shm = segments.get(message["shm"])
+        if shm is None:
+            # A client replaces its segment when it needs a larger one
+            for old in segments.values():
+                old.close()
+            segments.clear()
+            shm = segments[message["shm"]] = _attach(message["shm"])
+        if len(texts) * model.dim * 4 > shm.size:
+            raise ValueError("Shared buffer too small for the request")
+
+        vectors = self.server.encode(texts)
+        out = np.ndarray((len(texts), model.dim), dtype=np.float32, buffer=shm.buf)
+        out[:] = vectors
+        del out  # the segment can't be closed while a view exists
+        return {"rows": len(texts)}
+
+
+class _Connection:
+    def __init__(self, socket_path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.stream = self.sock.makefile("rb")
+        self.shm = None
+
+    def call(self, message):
+        _send(self.sock, message)
+        reply = _recv(self.stream)
+        if reply is None:
+            raise ConnectionError("Embedding server closed the connection")
+        if "error" in reply:
+            raise RuntimeError(f"Embedding server: {reply['error']}")
+        return reply
+
+    def buffer(self, nbytes):
+        # Grown by doubling so the daemon rarely has to attach a new segment
+        if self.shm is None or self.shm.size < nbytes:
+            self.release()
+            size = 1 << max(16, (nbytes - 1).bit_length())
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        return self.shm
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        self.release()
+        self.stream.close()
+        self.sock.close()
+
+
+class EmbeddingClient:
+    """
+    Talks to an EmbeddingServer with the interface of EmbeddingService
+    (encode, encode_query, name, dim, signature), so SemanticQA, the
+    keyword engine and the caches use it unchanged. encode returns the
+    caller's own copy of the rows in the shared buffer.
+
+    Calls check a connection (with its shared buffer) out of a pool of up to
+    max_connections, so concurrent sessions are batched by the daemon rather
+    than serialized here, without keeping a socket and a segment for every
+    thread that ever embedded something.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET or FALLBACK_SOCKET, timeout=120,
+                 max_connections=DEFAULT_CONNECTIONS):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, max_connections))
+        self._closed = False
+        connection = self._checkout()
+        try:
+            info = connection.call({"op": "info"})
+        finally:
+            self._checkin(connection)
+        self.name = info["name"]
+        self.dim = info["dim"]
+        self.signature = info["signature"]
+        atexit.register(self.close)
+
+    def encode(self, texts, convert_to_tensor=False, batch_size=None):
+        """
+        Embeds texts, returning a (len(texts), dim) float32 array of
+        unit-length rows. Batching is up to the daemon; batch_size is
+        accepted for compatibility and ignored.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        connection = self._checkout()
+        try:
+            try:
+                vectors = self._encode(connection, texts)
+            except (OSError, ConnectionError):
+                # Daemon restarted: reconnect once
+                self._discard(connection)
+                connection = _Connection(self.socket_path, self.timeout)
+                vectors = self._encode(connection, texts)
+        except BaseException:
+            self._discard(connection)
+            self._slots.release()
+            raise
+        self._checkin(connection)
+        return vectors
+
+    def encode_query(self, text):
+        return self.encode([text])[0]
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
+
+    def _encode(self, connection, texts):
+        shm = connection.buffer(len(texts) * self.dim * 4)
+        reply = connection.call({"op": "encode", "texts": texts, "shm": shm.name})
+        view = np.ndarray((reply["rows"], self.dim), dtype=np.float32, buffer=shm.buf)
+        # Copied out: the buffer is reused by the connection's next call
+        vectors = view.copy()
+        del view
+        return vectors
+
+    def _checkout(self):
+        # Blocks while max_connections calls are in flight
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return _Connection(self.socket_path, self.timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, connection):
+        if self._closed:
+            self._discard(connection)
+        else:
+            self._idle.put(connection)
+        self._slots.release()
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.close()
+        except (OSError, BufferError):
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=DEFAULT_SOCKET or FALLBACK_SOCKET)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-batch", type=int, default=256, help="Texts per shared forward pass.")
+    parser.add_argument("--wait-ms", type=float, default=5,
+                        help="How long a request waits for others to share its forward pass.")
+    args = parser.parse_args(argv)
+
+    # Batch size, threads and backend come from STUDY_BUDDY_EMBED_* variables
+    model = EmbeddingService(args.model)
+    server = EmbeddingServer(model, args.socket, max_batch=args.max_batch, wait_ms=args.wait_ms)
+    print(f"Serving {model.signature} on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import tracing
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+# Deployment knobs; the defaults suit the CPU-only hosts
+DEFAULT_BATCH_SIZE = int(os.environ.get("STUDY_BUDDY_EMBED_BATCH_SIZE", 64))
+DEFAULT_THREADS = int(os.environ.get("STUDY_BUDDY_EMBED_THREADS", 0)) or None
+# "torch", "onnx" (the int8-quantized ONNX export below, run by ONNX Runtime;
+# needs sentence-transformers[onnx]) or "int8" (torch with dynamically
+# quantized linear layers)
+DEFAULT_BACKEND = os.environ.get("STUDY_BUDDY_EMBED_BACKEND", "torch")
+
+# Quantized ONNX export shipped with the sentence-transformers models
+ONNX_INT8_FILE = "onnx/model_qint8_avx2.onnx"
+
+# Unix socket of a running embed_server.py daemon; when set, processes use
+# its model instead of loading their own
+DEFAULT_SOCKET = os.environ.get("STUDY_BUDDY_EMBED_SOCKET") or None
+
+
+class _Query:
+    __slots__ = ("text", "vector", "error", "ready")
+
+    def __init__(self, text):
+        self.text = text
+        self.vector = None
+        self.error = None
+        self.ready = threading.Event()
+
+
+class EmbeddingService:
+    """
+    Wraps a SentenceTransformer for throughput: inputs are sorted by length
+    so each batch pads to similar sizes, vectors come back as unit-length
+    float32, and question embeddings requested concurrently by different
+    sessions are merged into one forward pass.
+
+    encode() takes the same arguments SemanticQA uses on a raw
+    SentenceTransformer, so either can be passed as its model.
+    """
+
+    def __init__(
+        self,
+        model_name=DEFAULT_MODEL,
+        batch_size=DEFAULT_BATCH_SIZE,
+        threads=DEFAULT_THREADS,
+        backend=DEFAULT_BACKEND,
+        device=None,
+        query_wait_ms=5,
+    ):
+        """
+        Args:
+            model_name (str): sentence-transformers model to load.
+            batch_size (int): Texts per forward pass.
+            threads (int): Intra-op CPU threads (None = library default).
+            backend (str): "torch", "onnx" or "int8"; the last two are int8
+                CPU paths (a GPU always runs torch in float16).
+            device (str): "cpu", "cuda", ... (None = cuda if available). On a
+                GPU the model runs in float16.
+            query_wait_ms (float): How long the first pending question waits
+                for others to share its forward pass.
+        """
+        # Imported here so processes that only talk to an embedding daemon
+        # never load torch
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        self.name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self.backend = backend
+        self.query_wait = query_wait_ms / 1000.0
+
+        if backend not in ("torch", "onnx", "int8"):
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        if backend == "onnx":
+            try:
+                import onnxruntime
+                import optimum.onnxruntime
+            except ImportError as e:
+                raise ImportError(
+                    "The onnx embedding backend needs ONNX Runtime: pip install \"sentence-transformers[onnx]\""
+                ) from e
+            self.model = SentenceTransformer(
+                model_name, device=device, backend="onnx", model_kwargs={"file_name": ONNX_INT8_FILE}
+            )
+            precision = "qint8"
+        else:
+            self.model = SentenceTransformer(model_name, device=device)
+            if device.startswith("cuda"):
+                # Quantized linear layers are CPU-only; on a GPU int8 means float16
+                self.model.half()
+                self.backend = "torch"
+                precision = "fp16"
+            elif backend == "int8":
+                self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+                precision = "qint8"
+            else:
+                precision = "fp32"
+        self.dim = self.model.get_sentence_embedding_dimension()
+        # Vectors differ between backends and precisions, so caches key on
+        # what actually runs rather than on the model name alone
+        self.signature = f"{model_name}|{self.backend}|{precision}"
+
+        self._queries = []
+        self._queries_lock = threading.Lock()
+
+    def encode(self, texts, convert_to_tensor=False, batch_size=None):
+        """
+        Embeds texts, returning a (len(texts), dim) float32 array of
+        unit-length rows in input order.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        batch_size = batch_size or self.batch_size
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            ids = order[start:start + batch_size]
+            batch = [texts[i] for i in ids]
+            with tracing.span("embedding.batch", texts=len(ids), chars=sum(map(len, batch)), backend=self.backend):
+                vectors = self.model.encode(
+                    batch,
+                    batch_size=len(ids),
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                )
+            out[ids] = vectors
+            tracing.metrics.inc("embedding_texts_total", len(ids), backend=self.backend)
+        return out
+
+    def encode_query(self, text):
+        """
+        Embeds one question. Questions arriving within query_wait of each
+        other are encoded together; returns a (dim,) float32 vector.
+        """
+        query = _Query(text)
+        with self._queries_lock:
+            self._queries.append(query)
+            leader = len(self._queries) == 1
+
+        if leader:
+            # The first caller waits briefly, then encodes everything queued
+            time.sleep(self.query_wait)
+            with self._queries_lock:
+                batch, self._queries = self._queries, []
+            try:
+                vectors = self.encode([q.text for q in batch])
+            except Exception as e:
+                for q in batch:
+                    q.error = e
+                    q.ready.set()
+                raise
+            for q, vector in zip(batch, vectors):
+                q.vector = vector
+                q.ready.set()
+
+        query.ready.wait()
+        if query.error is not None:
+            raise query.error
+        return query.vector
+
+
+def load_model(model_name=DEFAULT_MODEL, socket_path=DEFAULT_SOCKET):
+    """
+    The embedding model for this process: a client of the shared daemon
+    when socket_path is set (see embed_server.py), otherwise an in-process
+    EmbeddingService. Both offer encode(), encode_query(), dim and signature.
+    """
+    if socket_path:
+        from embed_server import EmbeddingClient
+
+        return EmbeddingClient(socket_path)
+    return EmbeddingService(model_name)
@@ -0,0 +1,123 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function once cancellation has been requested."""
+
+
+class Job:
+    """
+    State of one background job. The job function receives the Job as its
+    first argument, reports through update() and calls check_cancelled()
+    between units of work. Readers (e.g. a polling UI) only look at the
+    public attributes.
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "QUEUED..."
+        # Partial output worth showing before the job finishes
+        self.preview = ""
+        # Intermediate results published as soon as they are ready
+        self.outputs = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+
+    def update(self, progress=None, message=None, preview=None):
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+        if preview is not None:
+            self.preview = preview
+
+    def publish(self, name, value):
+        self.outputs[name] = value
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+
+class JobManager:
+    """
+    Runs jobs on a small worker pool, independent of any one Streamlit
+    script run, so uploads keep going across reruns and several can be
+    processed at once. Finished jobs are kept for keep_seconds so their
+    results can still be collected.
+    """
+
+    def __init__(self, max_workers=2, keep_seconds=3600):
+        self.keep_seconds = keep_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues fn(job, *args, **kwargs) and returns the new job's id.
+
+        The return value of fn becomes job.result; an exception marks the
+        job failed with job.error set to its message.
+        """
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Requests cancellation; returns False if the job is unknown or already finished."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job._cancel.set()
+        return True
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check_cancelled()
+            job.status = RUNNING
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            if job._cancel.is_set():
+                # Stages interrupted by the cancellation fail as a side effect
+                job.status = CANCELLED
+            else:
+                job.error = str(e)
+                job.status = FAILED
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
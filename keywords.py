@@ -1,15 +1,217 @@
-from groq import Groq
+import re
+
+import numpy as np
+
+from llm_gateway import PRIORITY_BACKGROUND, get_gateway
+
+STOPWORDS = frozenset(
+    "a about above after again against all also am an and any are as at be because been before being below"
+    " between both but by can could did do does doing down during each few for from further had has have"
+    " having he her here hers him his how i if in into is it its itself just may me might more most must my"
+    " no nor not now of off on once one only or other our out over own same she should so some such than that"
+    " the their them then there these they this those through thus to too under until up upon use used using"
+    " very via was we were what when where which while who whom why will with within without would yet you"
+    " your e.g i.e etc".split()
+)
+# Section labels that say nothing about the content
+GENERIC_TERMS = frozenset(
+    "introduction overview chapter module unit section lecture part page pages figure fig table example"
+    " examples summary conclusion contents references appendix note notes".split()
+)
+SEGMENT_RE = re.compile(r"[.,;:!?()\[\]{}\"\n\t|/]+(?:\s|$)|[()\[\]{}\"\n\t|/]")
+WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9'+#-]*[A-Za-z0-9+#]|[A-Za-z]")
+
+class KeywordEngine:
+    """
+    Local keyword extraction over the whole document: candidate phrases are
+    scored with YAKE-style statistics over the chunk set (frequency, spread
+    across chunks, casing, position, phrase length) and then by similarity
+    of their embedding to the document centroid. No network round trip.
+    """
+
+    # Bump whenever scoring changes so cached keywords are invalidated
+    VERSION = 1
+
+    def __init__(self, model=None, max_keywords=10, max_words=3, candidates=60):
+        # Embedding model for the centroid step (optional)
+        self.model = model
+        self.max_keywords = max_keywords
+        self.max_words = max_words
+        # Best statistical candidates that are embedded and re-ranked
+        self.candidates = candidates
+
+    def extract(self, chunks, embeddings=None):
+        """
+        Args:
+            chunks (list): Chunk texts covering the document.
+            embeddings: Their vectors (rows aligned with chunks), if any.
+
+        Returns:
+            list: (phrase, weight) pairs, best first; weights are in (0, 1]
+            with 1 for the top phrase.
+        """
+        return [(phrase, weight) for phrase, weight, _ in self.extract_clusters(chunks, embeddings)]
+
+    def extract_clusters(self, chunks, embeddings=None, cluster_size=4):
+        """
+        Like extract, but each keyword also comes with up to cluster_size
+        related candidate phrases (nearest by embedding, itself first), e.g.
+        for ConceptExtractor.label_clusters.
+
+        Returns:
+            list: (phrase, weight, members) triples, best first.
+        """
+        stats = self._candidates(chunks)
+        if not stats:
+            return []
+
+        phrases = list(stats)
+        count, df, cased, first, words = (np.array(column, dtype=np.float32) for column in zip(
+            *((entry[0], entry[1], entry[3], entry[4], len(p.split())) for p, entry in stats.items())
+        ))
+        n_chunks = max(1, len(chunks))
+        score = (
+            np.log1p(count)
+            * (0.3 + df / n_chunks)            # spread over the document
+            * (1.0 + cased / count)            # names, acronyms
+            * (1.0 + 0.3 * (words - 1))        # specific multi-word phrases
+            * (1.1 - 0.2 * first / n_chunks)   # early mentions weigh a little more
+            / self._relatedness(phrases, stats)
+        )
+        if n_chunks > 1:
+            score[count < 2] = 0
+
+        top = [i for i in np.argsort(-score)[:self.candidates * 2] if score[i] > 0]
+        top = self._drop_fragments(top, phrases, count)[:self.candidates]
+        if not top:
+            return []
+        score = score[top] / score[top].max()
+        phrases = [stats[phrases[i]][5] for i in top]
+
+        vectors = None
+        if self.model is not None and embeddings is not None and len(embeddings):
+            centroid = _unit(np.mean(np.asarray(embeddings, dtype=np.float32), axis=0))
+            vectors = np.asarray(self.model.encode(phrases, convert_to_tensor=False), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+            score = score * (0.4 + 0.6 * np.clip(vectors @ centroid, 0, 1))
+
+        # Greedy pick, skipping near-duplicates of phrases already chosen
+        chosen = []
+        for i in np.argsort(-score):
+            if vectors is not None and any(vectors[i] @ vectors[j] > 0.8 for j in chosen):
+                continue
+            chosen.append(int(i))
+            if len(chosen) == self.max_keywords:
+                break
+
+        members = [[phrases[i]] for i in chosen]
+        if vectors is not None:
+            nearest = np.argmax(vectors @ vectors[chosen].T, axis=1)
+            for i in np.argsort(-score):
+                group = members[nearest[i]]
+                if i not in chosen and len(group) < cluster_size:
+                    group.append(phrases[i])
+
+        best = score[chosen[0]]
+        return [(phrases[i], float(score[i] / best), group) for i, group in zip(chosen, members)]
+
+    @staticmethod
+    def _relatedness(phrases, stats):
+        # YAKE's context term: a frequent word seen next to many different
+        # words (like "value" or "return") behaves like a stopword. Per word
+        # 1 + (distinct neighbours / uses) * (uses / most uses); phrases
+        # take the mean over their words.
+        unigrams = {p: entry for p, entry in stats.items() if " " not in p}
+        max_count = max((entry[0] for entry in unigrams.values()), default=1)
+        factor = {
+            p: 1.0 + min(1.0, len(entry[6]) / (2.0 * entry[0])) * entry[0] / max_count * 4.0
+            for p, entry in unigrams.items()
+        }
+        return np.array([
+            np.mean([factor.get(w, 1.0) for w in phrase.split() if w not in STOPWORDS] or [1.0])
+            for phrase in phrases
+        ], dtype=np.float32)
+
+    def _candidates(self, chunks):
+        # phrase -> [count, chunk count, last chunk, cased count, first chunk,
+        # surface form, distinct neighbouring words (single words only)]
+        stats = {}
+        for chunk_id, chunk in enumerate(chunks):
+            for segment in SEGMENT_RE.split(chunk):
+                words = WORD_RE.findall(segment)
+                lower = [w.lower() for w in words]
+                for i in range(len(words)):
+                    if lower[i] in STOPWORDS:
+                        continue
+                    for n in range(1, self.max_words + 1):
+                        if i + n > len(words) or lower[i + n - 1] in STOPWORDS:
+                            continue
+                        gram = lower[i:i + n]
+                        # "theory of computation" is a phrase, "dropout and weight" is not
+                        if any(w in STOPWORDS and w != "of" for w in gram[1:-1]):
+                            break
+                        if all(w in GENERIC_TERMS or w in STOPWORDS for w in gram):
+                            continue
+                        if n == 1 and len(gram[0]) < 3:
+                            continue
+                        phrase = " ".join(gram)
+                        entry = stats.get(phrase)
+                        if entry is None:
+                            entry = stats[phrase] = [0, 0, -1, 0, chunk_id, " ".join(words[i:i + n]), set()]
+                        if n == 1:
+                            if i > 0:
+                                entry[6].add(lower[i - 1])
+                            if i + 1 < len(words):
+                                entry[6].add(lower[i + 1])
+                        entry[0] += 1
+                        if entry[2] != chunk_id:
+                            entry[1] += 1
+                            entry[2] = chunk_id
+                        # Capitalized mid-sentence (names) or all caps (acronyms)
+                        if (i > 0 and words[i][0].isupper()) or (words[i].isupper() and len(words[i]) > 1):
+                            if entry[3] == 0:
+                                entry[5] = " ".join(words[i:i + n])
+                            entry[3] += 1
+        return stats
+
+    @staticmethod
+    def _drop_fragments(order, phrases, count):
+        # "descent" is dropped when nearly all its uses are inside another
+        # candidate such as "gradient descent"
+        split = {i: phrases[i].split() for i in order}
+        return [
+            i for i in order
+            if not any(
+                j != i and count[i] <= 1.25 * count[j] and _contains(split[j], split[i])
+                for j in order
+            )
+        ]
+
+
+def _contains(longer, shorter):
+    n = len(shorter)
+    return n < len(longer) and any(longer[k:k + n] == shorter for k in range(len(longer) - n + 1))
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
 
 class ConceptExtractor:
-    def __init__(self, api_key):
-        self.client = Groq(api_key=api_key)
+    # Bump whenever the prompt changes so cached keywords are invalidated
+    PROMPT_VERSION = 2
+
+    def __init__(self, api_key, gateway=None):
+        # Shared, rate-limited Groq access (see llm_gateway)
+        self.gateway = gateway or get_gateway(api_key)
         self.model = 'llama-3.1-8b-instant'
 
     def extract_keywords(self, text):
         if not text:
             return []
         
-        # Use a larger sample of summary (up to 3000 chars) for better context
+        # Use a larger sample of the text (up to 3000 chars) for better context
         context = text[:3000]
 
         prompt = (
@@ -23,9 +225,10 @@ class ConceptExtractor:
         )
 
         try:
-            response = self.client.chat.completions.create(
+            response = self.gateway.chat(
                 messages=[{'role': 'user', 'content': prompt}],
-                model=self.model
+                model=self.model,
+                priority=PRIORITY_BACKGROUND,
             )
             
             raw_text = response.choices[0].message.content
@@ -36,4 +239,34 @@ class ConceptExtractor:
             
         except Exception as e:
             print(f"AI Keyword Error: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    def label_clusters(self, clusters):
+        """
+        Optional single LLM pass naming groups of related phrases (see
+        KeywordEngine.extract_clusters). Returns one label per cluster; a cluster's
+        first phrase is kept where the model gives no usable label.
+        """
+        if not clusters:
+            return []
+        listing = "\n".join(f"{n}. {', '.join(group)}" for n, group in enumerate(clusters, start=1))
+        prompt = (
+            "Each numbered line below lists related phrases from one document. "
+            "Give each line a short, specific topic label (1-4 words)."
+            "\nReturn exactly one line per group as 'n. label', nothing else."
+            f"\nGroups:\n{listing}"
+        )
+        labels = [group[0] for group in clusters]
+        try:
+            response = self.gateway.chat(
+                messages=[{'role': 'user', 'content': prompt}],
+                model=self.model,
+                priority=PRIORITY_BACKGROUND,
+            )
+            for line in response.choices[0].message.content.splitlines():
+                match = re.match(r"\s*(\d+)[.)]\s*(.+)", line)
+                if match and 1 <= int(match.group(1)) <= len(labels):
+                    labels[int(match.group(1)) - 1] = match.group(2).strip()
+        except Exception as e:
+            print(f"AI Keyword Error: {e}")
+        return labels
@@ -0,0 +1,300 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from groq import APIConnectionError, Groq
+
+import tracing
+from chunker import estimate_tokens
+
+# Lower value = served first. Interactive questions overtake background
+# summarization and keyword extraction waiting for the same rate budget.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Groq free-tier limits for llama-3.1-8b-instant; override per deployment
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get("GROQ_REQUESTS_PER_MINUTE", 30))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("GROQ_TOKENS_PER_MINUTE", 6000))
+
+# Completion tokens assumed when the caller gives no max_tokens; corrected
+# against the reported usage once the response arrives
+EXPECTED_COMPLETION_TOKENS = 512
+
+
+class TokenBucket:
+    """Continuously refilling budget of `rate_per_minute` units."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.level = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount, now):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill(now)
+        # A single request larger than the whole bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount, now):
+        # May go negative: usage reported above the estimate is paid back later
+        self._refill(now)
+        self.level -= amount
+
+
+class LLMGateway:
+    """
+    Single entry point for Groq chat completions. Owns one pooled client,
+    keeps every caller within the requests- and tokens-per-minute budget,
+    admits waiting requests by priority, and retries transient failures
+    with exponential backoff, full jitter and Retry-After.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        client=None,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+        max_concurrency=8,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=30.0,
+    ):
+        # Retries are handled here, so the SDK's own retry loop is disabled
+        self.client = client or Groq(api_key=api_key, max_retries=0)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._blocked_until = 0.0
+        self._in_flight = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0, "queue_wait": 0.0}
+
+    def chat(self, messages, model, priority=PRIORITY_BACKGROUND, **kwargs):
+        """
+        Sends one chat completion, waiting for rate budget first.
+
+        Args:
+            messages (list): Chat messages, as for client.chat.completions.create.
+            model (str): Model name.
+            priority (int): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND.
+            **kwargs: Passed through (temperature, max_tokens, ...).
+
+        Returns:
+            The completion object from the client.
+        """
+        estimate = sum(estimate_tokens(m["content"]) for m in messages)
+        estimate += kwargs.get("max_tokens") or EXPECTED_COMPLETION_TOKENS
+
+        with tracing.span("llm.chat", model=model, priority=priority, estimated_tokens=estimate) as span:
+            attempt = 0
+            queue_wait = 0.0
+            while True:
+                queue_wait += self._acquire(priority, estimate)
+                try:
+                    response = self.client.chat.completions.create(messages=messages, model=model, **kwargs)
+                except Exception as e:
+                    self._release()
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        with self._cond:
+                            self.stats["failures"] += 1
+                        _record_call(span, model, attempt, queue_wait, None, failed=True)
+                        raise
+                    attempt += 1
+                    self._backoff(e, attempt)
+                    continue
+
+                usage = getattr(response, "usage", None)
+                self._release(estimate, usage)
+                _record_call(span, model, attempt, queue_wait, usage)
+                return response
+
+    def chat_stream(self, messages, model, priority=PRIORITY_BACKGROUND, usage_out=None, **kwargs):
+        """
+        Streaming variant of chat: yields content deltas as they arrive.
+
+        Failures before the first token are retried like chat; once output
+        has started an error propagates to the caller. The rate-limit slot is
+        held until the stream is exhausted or closed.
+
+        Args:
+            usage_out (dict): Optional; once the stream ends it holds the
+                prompt_tokens, completion_tokens and total_tokens Groq
+                reported for it.
+        """
+        estimate = sum(estimate_tokens(m["content"]) for m in messages)
+        estimate += kwargs.get("max_tokens") or EXPECTED_COMPLETION_TOKENS
+
+        # A generator can't hold the current span across yields, so the span
+        # is opened detached and closed when the stream ends
+        span = tracing.tracer.start("llm.chat_stream", model=model, priority=priority, estimated_tokens=estimate)
+        requested = time.monotonic()
+        attempt = 0
+        queue_wait = 0.0
+        try:
+            while True:
+                queue_wait += self._acquire(priority, estimate)
+                usage = None
+                started = False
+                error = None
+                stream = None
+                try:
+                    stream = self.client.chat.completions.create(
+                        messages=messages, model=model, stream=True, **kwargs
+                    )
+                    for chunk in stream:
+                        # Groq reports usage on the final chunk
+                        x_groq = getattr(chunk, "x_groq", None)
+                        usage = getattr(x_groq, "usage", None) or usage
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            if not started:
+                                span.set(ttft_s=time.monotonic() - requested)
+                            started = True
+                            yield delta
+                except Exception as e:
+                    error = e
+                finally:
+                    # Also runs when the consumer stops early (a closed
+                    # generator): close the HTTP response rather than leave
+                    # it to garbage collection
+                    if stream is not None and hasattr(stream, "close"):
+                        try:
+                            stream.close()
+                        except Exception:
+                            pass
+                    self._release(estimate, usage)
+
+                if error is None:
+                    _record_call(span, model, attempt, queue_wait, usage)
+                    if usage_out is not None and usage is not None:
+                        for name in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                            usage_out[name] = getattr(usage, name, None) or 0
+                    return
+                if started or attempt >= self.max_retries or not _is_retryable(error):
+                    with self._cond:
+                        self.stats["failures"] += 1
+                    _record_call(span, model, attempt, queue_wait, usage, failed=True)
+                    span.end(error=error)
+                    raise error
+                attempt += 1
+                self._backoff(error, attempt)
+        finally:
+            span.end()
+
+    def _acquire(self, priority, tokens):
+        """Waits for a slot and budget; returns the seconds spent waiting."""
+        ticket = (priority, next(self._seq))
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] == ticket and self._in_flight < self.max_concurrency:
+                        now = time.monotonic()
+                        delay = max(
+                            self._blocked_until - now,
+                            self._requests.delay_for(1, now),
+                            self._tokens.delay_for(tokens, now),
+                        )
+                        if delay <= 0:
+                            heapq.heappop(self._waiting)
+                            self._requests.consume(1, now)
+                            self._tokens.consume(tokens, now)
+                            self._in_flight += 1
+                            self.stats["requests"] += 1
+                            self.stats["queue_wait"] += now - started
+                            self._cond.notify_all()
+                            return now - started
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+
+    def _release(self, estimate=None, usage=None):
+        with self._cond:
+            self._in_flight -= 1
+            if usage is not None and getattr(usage, "total_tokens", None):
+                # Settle the difference between the estimate and real usage
+                self._tokens.consume(usage.total_tokens - estimate, time.monotonic())
+            self._cond.notify_all()
+
+    def _backoff(self, error, attempt):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = _retry_after(error)
+        with self._cond:
+            self.stats["retries"] += 1
+            if getattr(error, "status_code", None) == 429:
+                self.stats["rate_limited"] += 1
+                # The limit is per API key: pause every caller, not just this one
+                pause = retry_after if retry_after is not None else delay
+                self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+                self._cond.notify_all()
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        time.sleep(delay)
+
+
+def _record_call(span, model, retries, queue_wait, usage, failed=False):
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    span.set(
+        retries=retries, queue_wait_s=queue_wait,
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+    )
+    tracing.metrics.inc("llm_requests_total", model=model, outcome="error" if failed else "ok")
+    tracing.metrics.inc("llm_retries_total", retries, model=model)
+    tracing.metrics.inc("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+    tracing.metrics.inc("llm_tokens_total", completion_tokens, model=model, kind="completion")
+    tracing.metrics.observe("llm_queue_wait_seconds", queue_wait, model=model)
+
+
+def _is_retryable(error):
+    if isinstance(error, APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return status in (408, 409, 429) or (status is not None and status >= 500)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(api_key):
+    """Returns the process-wide gateway for an API key, creating it once."""
+    with _gateways_lock:
+        if api_key not in _gateways:
+            _gateways[api_key] = LLMGateway(api_key=api_key)
+        return _gateways[api_key]
@@ -1,5 +1,129 @@
+import os
+import time
 import PyPDF2
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from multiprocessing import get_all_start_methods, get_context, shared_memory
+
+import tracing
+
+# Below this many pages the cost of starting worker processes outweighs the gain
+PARALLEL_MIN_PAGES = 64
+# Start method for extraction workers (see _iter_texts_parallel)
+_START_METHOD = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+
+def iter_pdf_pages(uploaded_file, workers=None):
+    """
+    Streams the text of a PDF file uploaded via Streamlit, one page at a time.
+    
+    Args:
+        uploaded_file: The file object from st.file_uploader.
+        workers (int): Extraction processes to use; defaults to the CPU count.
+            Small files (under PARALLEL_MIN_PAGES pages) are always parsed serially.
+        
+    Yields:
+        dict: {"page": 1-based page number, "text": page text ("" if none),
+        "start"/"end": character offsets of the page in the text returned by
+        extract_text_from_pdf, before its final strip}.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    try:
+        with tracing.span("pdf.open") as span:
+            # Seekable uploads are parsed in place instead of copied into a BytesIO
+            if hasattr(uploaded_file, "seekable") and uploaded_file.seekable():
+                stream = uploaded_file
+            else:
+                stream = BytesIO(uploaded_file.read())
+            pdf_reader = PyPDF2.PdfReader(stream)
+            pages = pdf_reader.pages
+            page_count = len(pages)
+            span.set(pages=page_count)
+    except Exception as e:
+        raise ValueError(f"Error reading PDF: {str(e)}")
+
+    if workers > 1 and page_count >= PARALLEL_MIN_PAGES:
+        stream.seek(0)
+        texts = _iter_texts_parallel(stream.read(), page_count, workers)
+    else:
+        texts = _iter_texts_serial(pages)
+
+    offset = 0
+    for number, text in enumerate(texts, start=1):
+        yield {"page": number, "text": text, "start": offset, "end": offset + len(text)}
+        if text:
+            offset += len(text) + 1
+
+def _iter_texts_serial(pages):
+    for number, page in enumerate(pages, start=1):
+        started = time.time_ns()
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            raise ValueError(f"Error reading PDF page {number}: {str(e)}")
+        _record_page(number, text, started, time.time_ns())
+        yield text
+
+def _record_page(number, text, started, ended, worker=False):
+    tracing.tracer.record("pdf.page", started, ended, page=number, chars=len(text), worker=worker)
+    tracing.metrics.inc("pdf_pages_total")
+
+def _iter_texts_parallel(data, page_count, workers):
+    # The PDF is copied into shared memory once; each worker process attaches
+    # to it and opens its own PdfReader instead of receiving the bytes per task
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+
+        # Several contiguous ranges per worker to balance uneven pages
+        step = max(1, -(-page_count // (workers * 4)))
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+        # Callers run in threads (job pool, Streamlit), and forking a threaded
+        # process can copy a lock another thread holds into the worker
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context(_START_METHOD),
+            initializer=_init_worker,
+            initargs=(shm.name, len(data)),
+        )
+        try:
+            # map() returns ranges in submission order, i.e. page order
+            for (start, _), texts in zip(ranges, executor.map(_extract_range, ranges)):
+                for number, (text, started, ended) in enumerate(texts, start=start + 1):
+                    if isinstance(text, Exception):
+                        raise ValueError(f"Error reading PDF page {number}: {str(text)}")
+                    # Timed in the worker; recorded here, under the caller's span
+                    _record_page(number, text, started, ended, worker=True)
+                    yield text
+        finally:
+            # map() queued every range up front: on an error or a cancelled
+            # job, drop the ones not started instead of parsing the rest
+            executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        shm.close()
+        shm.unlink()
+
+_worker_reader = None
+
+def _init_worker(shm_name, size):
+    global _worker_reader
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_reader = PyPDF2.PdfReader(BytesIO(bytes(shm.buf[:size])))
+    shm.close()
+
+def _extract_range(page_range):
+    # (text or exception, start ns, end ns) per page
+    texts = []
+    for index in range(*page_range):
+        started = time.time_ns()
+        try:
+            text = _worker_reader.pages[index].extract_text() or ""
+        except Exception as e:
+            text = e
+        texts.append((text, started, time.time_ns()))
+    return texts
 
 def extract_text_from_pdf(uploaded_file):
     """
@@ -11,17 +135,8 @@ def extract_text_from_pdf(uploaded_file):
     Returns:
         str: The extracted text content.
     """
-    try:
-        # Use BytesIO to treat the uploaded file as a file-like object
-        pdf_reader = PyPDF2.PdfReader(BytesIO(uploaded_file.read()))
-        text = ""
-        
-        # Iterate through each page and extract text
-        for page in pdf_reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
-                
-        return text.strip()
-    except Exception as e:
-        raise ValueError(f"Error reading PDF: {str(e)}")
\ No newline at end of file
+    return join_pages(iter_pdf_pages(uploaded_file))
+
+def join_pages(pages):
+    """Joins page records back into the single document string."""
+    return "\n".join(record["text"] for record in pages if record["text"]).strip()
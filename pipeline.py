@@ -0,0 +1,354 @@
+import io
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tracing
+from cache import document_key
+from jobs import JobCancelled
+from keywords import ConceptExtractor, KeywordEngine
+from pdf_reader import iter_pdf_pages, join_pages
+from qa import SemanticQA
+from summarizer import SemanticSummarizer
+
+
+class PageFeed:
+    """
+    Page records being read, iterable by several consumers at once while
+    reading is still in progress. Each iterator blocks until the next page
+    arrives or the feed is closed.
+    """
+
+    def __init__(self):
+        self.pages = []
+        self._chars = 0
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def append(self, record):
+        with self._cond:
+            self.pages.append(record)
+            self._chars += len(record["text"])
+            self._cond.notify_all()
+
+    def close(self, error=None):
+        with self._cond:
+            self._closed = True
+            self._error = error
+            self._cond.notify_all()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.pages) and not self._closed:
+                    self._cond.wait()
+                if i >= len(self.pages):
+                    if self._error is not None:
+                        raise RuntimeError("Reading the document failed") from self._error
+                    return
+                record = self.pages[i]
+            i += 1
+            yield record
+
+
+class StageGraph:
+    """
+    Minimal dependency graph of pipeline stages. Each stage starts as soon
+    as the stages it depends on have finished and receives their outputs as
+    positional arguments.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        # Set when a stage fails; long-running stages should check it and stop
+        self.failed = threading.Event()
+
+    def add(self, name, fn, deps=()):
+        self.stages[name] = (fn, tuple(deps))
+
+    def run(self, on_ready=None):
+        """
+        Runs every stage and returns {name: output}. on_ready(name, output)
+        is called as each stage finishes. The first stage error is re-raised
+        once the stages already running have stopped.
+        """
+        outputs = {}
+        remaining = dict(self.stages)
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stages))) as executor:
+            while remaining or running:
+                if error is None:
+                    for name, (fn, deps) in list(remaining.items()):
+                        if all(dep in outputs for dep in deps):
+                            stage = tracing.tracer.wrap(_traced_stage(name, fn))
+                            running[executor.submit(stage, *(outputs[dep] for dep in deps))] = name
+                            del remaining[name]
+                    if not running:
+                        raise ValueError(f"Unsatisfiable stage dependencies: {sorted(remaining)}")
+                elif not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        outputs[name] = future.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+                            self.failed.set()
+                        continue
+                    if on_ready is not None:
+                        on_ready(name, outputs[name])
+
+        if error is not None:
+            raise error
+        return outputs
+
+
+def _traced_stage(name, fn):
+    def run(*args):
+        with tracing.span(f"stage.{name}"):
+            return fn(*args)
+    return run
+
+
+def _restore(cache_key, cached, summarizer, qa_system, index_store):
+    # Sessions on the same document share one resident index
+    shared = index_store.get(cache_key)
+    if shared is not None:
+        qa_system.attach_index(*shared)
+    else:
+        qa_system.load_context(cached["chunks"], cached["embeddings"])
+        index_store.put(cache_key, qa_system.index, qa_system.context_chunks)
+    return {
+        "doc_key": cache_key,
+        "text": cached["text"],
+        # Entries written before the reduced summary was stored still need a reduce
+        "summary": cached.get("summary") or summarizer.reduce(cached["chunk_summaries"]),
+        "summary_parts": cached["chunk_summaries"],
+        "keywords": cached["keywords"],
+        "qa_system": qa_system,
+        "chunk_summaries": dict(zip(cached.get("chunk_hashes", []), cached["chunk_summaries"])),
+    }
+
+
+def load_document(
+    doc_key,
+    api_key,
+    embedding_model,
+    result_cache,
+    response_cache,
+    index_store,
+    embedding_cache=None,
+    reranker=None,
+    answer_cache=None,
+    gateway=None,
+):
+    """
+    Rebuilds the run_pipeline result of an already analysed document from
+    the shared caches, e.g. on another server process than the one that ran
+    the job. Arguments are as for run_pipeline.
+
+    Returns:
+        dict: As run_pipeline, or None if doc_key is not in the result cache.
+    """
+    cached = result_cache.get(doc_key)
+    if cached is None:
+        return None
+    summarizer = SemanticSummarizer(api_key=api_key, response_cache=response_cache, gateway=gateway)
+    qa_system = SemanticQA(
+        embedding_model,
+        api_key=api_key,
+        response_cache=response_cache,
+        embedding_cache=embedding_cache,
+        reranker=reranker,
+        answer_cache=answer_cache,
+        gateway=gateway,
+    )
+    return _restore(doc_key, cached, summarizer, qa_system, index_store)
+
+
+def run_pipeline(
+    job,
+    pdf_bytes,
+    api_key,
+    embedding_model,
+    embedding_model_name,
+    result_cache,
+    response_cache,
+    index_store,
+    previous_summaries=None,
+    previous_qa=None,
+    embedding_cache=None,
+    reranker=None,
+    answer_cache=None,
+    label_keywords=False,
+    gateway=None,
+    summary_workers=4,
+):
+    """
+    Analyses one uploaded PDF: summary, key topics and the QA context. Meant
+    to run as a jobs.JobManager job; progress and the latest summary
+    sections are reported through `job`.
+
+    Results are written to the shared result cache and index store, so any
+    session uploading the same document later gets them without recomputing.
+
+    Args:
+        job (jobs.Job): Progress/cancellation handle.
+        pdf_bytes (bytes): Raw bytes of the uploaded PDF.
+        api_key (str): Groq API key.
+        embedding_model: EmbeddingService (or a bare SentenceTransformer).
+        embedding_model_name (str): Its name, part of the cache key.
+        result_cache (cache.ResultCache): Shared on-disk results.
+        response_cache (cache.LLMResponseCache): Shared LLM response memo.
+        index_store (vector_index.IndexStore): Shared vector indexes.
+        previous_summaries (dict): chunk_summaries of the session's previous
+            document, reused for unchanged chunks.
+        previous_qa (SemanticQA): The session's previous QA context, whose
+            embeddings are reused for unchanged chunks.
+        embedding_cache (cache.EmbeddingCache): Shared chunk embeddings;
+            only chunks missing from it are encoded.
+        reranker: Optional cross-encoder for the QA system (see SemanticQA).
+        answer_cache (cache.SemanticAnswerCache): Shared answers to
+            paraphrased questions.
+        label_keywords (bool): Let the LLM name each keyword cluster (one
+            request); otherwise keywords are fully local.
+        gateway (llm_gateway.LLMGateway): Rate-limited client to use instead
+            of the process-wide one for api_key.
+        summary_workers (int): Summary requests this document may have in
+            flight at once.
+
+    Returns:
+        dict: {"doc_key", "text", "summary", "summary_parts", "keywords",
+        "qa_system", "chunk_summaries"}; summary is the reduced summary and
+        summary_parts the per-chunk summaries it was built from.
+    """
+    with tracing.span("pipeline.run", pdf_bytes=len(pdf_bytes)) as span:
+        summarizer = SemanticSummarizer(
+            api_key=api_key, max_workers=summary_workers, response_cache=response_cache, gateway=gateway
+        )
+        extractor = ConceptExtractor(api_key=api_key, gateway=gateway)
+
+        # Identical bytes + models + prompts => identical results
+        cache_key = document_key(
+            pdf_bytes,
+            f"{summarizer.model}|{extractor.model}|{embedding_model_name}",
+            f"{SemanticSummarizer.PROMPT_VERSION}.{ConceptExtractor.PROMPT_VERSION}.{KeywordEngine.VERSION}"
+            f"{'+labels' if label_keywords else ''}",
+        )
+        qa_system = SemanticQA(
+            embedding_model,
+            api_key=api_key,
+            response_cache=response_cache,
+            embedding_cache=embedding_cache,
+            reranker=reranker,
+            answer_cache=answer_cache,
+            gateway=gateway,
+        )
+
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            job.update(0.5, "LOADING CACHED ANALYSIS...")
+            span.set(cached=True)
+            return _restore(cache_key, cached, summarizer, qa_system, index_store)
+
+        # Embedding (local CPU) and the summary map phase (remote) don't depend
+        # on each other: both read the same page feed concurrently, and the
+        # document is ready after the longer of them rather than their sum.
+        # Keywords are computed locally from the embedded chunks.
+        feed = PageFeed()
+        graph = StageGraph()
+
+        def checkpoint():
+            job.check_cancelled()
+            if graph.failed.is_set():
+                raise JobCancelled()
+
+        def read_pages():
+            try:
+                for record in iter_pdf_pages(io.BytesIO(pdf_bytes)):
+                    checkpoint()
+                    feed.append(record)
+                    job.update(message=f"READING PAGE {record['page']}...")
+            except BaseException as e:
+                feed.close(e)
+                raise
+            feed.close()
+            return feed.pages
+
+        def summarize():
+            # A re-upload of an edited document only pays for changed chunks
+            summary_parts = []
+            sections = []
+            for kind, text in summarizer.summarize_stream(iter(feed), previous=previous_summaries):
+                checkpoint()
+                if kind == "section":
+                    # Each ## section is shown as soon as it has been generated
+                    sections.append(text)
+                    job.update(message=f"ANALYZING CONTENT... {len(sections)} SECTIONS", preview="\n\n".join(sections[-3:]))
+                else:
+                    summary_parts.append(text)
+            return summary_parts
+
+        def extract_keywords(qa_system):
+            engine = KeywordEngine(embedding_model)
+            if not label_keywords:
+                return engine.extract(qa_system.context_chunks, qa_system.chunk_embeddings)
+            clusters = engine.extract_clusters(qa_system.context_chunks, qa_system.chunk_embeddings)
+            labels = extractor.label_clusters([members for _, _, members in clusters])
+            return [(label, weight) for label, (_, weight, _) in zip(labels, clusters)]
+
+        def embed():
+            qa_system.prepare_context_pages(iter(feed), previous=previous_qa)
+            checkpoint()
+            return qa_system
+
+        graph.add("pages", read_pages)
+        def reduce(summary_parts):
+            job.update(message="CONDENSING SUMMARY...")
+            return summarizer.reduce(summary_parts)
+
+        graph.add("summary", summarize)
+        graph.add("reduced", reduce, deps=("summary",))
+        graph.add("embeddings", embed)
+        graph.add("keywords", extract_keywords, deps=("embeddings",))
+
+        def publish(name, value):
+            job.publish(name, value)
+            job.update(progress=0.1 + 0.9 * len(job.outputs) / len(graph.stages))
+
+        job.update(0.1, "READING FILE...")
+        outputs = graph.run(on_ready=publish)
+
+        raw_text = join_pages(outputs["pages"])
+        if not raw_text:
+            raise ValueError("COULD NOT READ TEXT.")
+        summary_parts = outputs["summary"]
+        summary = outputs["reduced"]
+        keywords = outputs["keywords"]
+
+        # Don't persist transient API failures, including unmerged summaries
+        # left by a failed reduce step
+        failed = any(part.startswith("Error:") for part in summary_parts) or summarizer.reduce_failures
+        if not failed:
+            result_cache.put(
+                cache_key, raw_text, summary_parts, keywords,
+                qa_system.context_chunks, qa_system.chunk_embeddings,
+                chunk_hashes=summarizer.chunk_hashes, summary=summary,
+            )
+            index_store.put(cache_key, qa_system.index, qa_system.context_chunks)
+
+        return {
+            "doc_key": cache_key,
+            "text": raw_text,
+            "summary": summary,
+            "summary_parts": summary_parts,
+            "keywords": keywords,
+            "qa_system": qa_system,
+            "chunk_summaries": summarizer.chunk_summaries,
+        }
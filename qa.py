@@ -1,62 +1,426 @@
+import hashlib
+import time
 import numpy as np
-from groq import Groq
-from sentence_transformers import SentenceTransformer
+from bm25 import BM25Index, reciprocal_rank_fusion
+from chunker import chunk_hash, estimate_tokens, iter_chunks
+import tracing
+from llm_gateway import PRIORITY_INTERACTIVE, get_gateway
+from vector_index import ExactIndex, IVFIndex, build_index
+
+SYSTEM_PROMPT = (
+    "You are a precise document analyzer. "
+    "Answer the user's question based ONLY on the provided context segments."
+    "\nINSTRUCTIONS:"
+    "\n1. SYNTHESIZE: If information in Source 1 contradicts Source 2, reconcile it."
+    "\n2. ACCURACY: If the answer is not in the context, say 'The text does not contain this information'."
+    "\n3. COMPLETE: Provide a comprehensive answer using all sources."
+)
+
+# With index_backend="auto", corpora above this many chunks use an IVF index
+# instead of a linear scan, aiming to keep retrieval within RETRIEVAL_BUDGET_MS.
+# Searches over the budget are counted in qa_retrieval_over_budget_total
+IVF_THRESHOLD = 10000
+RETRIEVAL_BUDGET_MS = 50
+
+# Dense and BM25 candidates considered per question before fusion
+CANDIDATES = 20
 
 class SemanticQA:
-    def __init__(self, model, api_key):
+    def __init__(
+        self,
+        model,
+        api_key,
+        response_cache=None,
+        index_backend="auto",
+        gateway=None,
+        embedding_cache=None,
+        reranker=None,
+        answer_cache=None,
+    ):
         self.model = model
-        self.client = Groq(api_key=api_key)
+        # Shared, rate-limited Groq access (see llm_gateway)
+        self.gateway = gateway or get_gateway(api_key)
+        self.llm_model = 'llama-3.1-8b-instant'
+        self.temperature = 0.1 # Low temp for factual accuracy
+        # Retrieval chunks are smaller than summary chunks and overlap a little
+        self.chunk_tokens = 200
+        self.chunk_overlap = 40
+        # Page-aligned chunks keep an edit from shifting every later chunk
+        self.page_aligned = True
+        # Optional LLMResponseCache shared across sessions
+        self.response_cache = response_cache
+        # Optional cache.EmbeddingCache for the same model
+        self.embedding_cache = embedding_cache
+        # Optional cache.SemanticAnswerCache for paraphrased questions,
+        # shared by every session on the same context
+        self.answer_cache = answer_cache
+        # Fingerprint of the chunk list; changes whenever the index does
+        self.context_version = ""
+        # "auto" or one of vector_index.INDEX_BACKENDS: "exact", "ivf", "int8"
+        self.index_backend = index_backend
+        self.index = None
+        # Keyword index over the same chunks, fused with the dense ranking so
+        # exact terms (acronyms, course codes, formula names) are not missed
+        self.bm25 = BM25Index()
+        # Optional cross-encoder (anything with predict(pairs)) that rescores
+        # the fused candidates
+        self.reranker = reranker
+        # Context chunks are added best first until this many tokens are used
+        self.context_token_budget = 1200
+        self.max_sources = 6
         self.chunk_embeddings = None
         self.context_chunks = []
+        self.chunk_hashes = []
+        self.reused_chunks = 0
+        # Library mode: per-chunk {"doc_id", "page", "offset"} and doc_id -> title
+        self.chunk_meta = []
+        self.documents = {}
+        self._chunk_docs = np.empty(0, dtype=np.int64)
+        self.last_retrieval_ms = 0.0
+        # Latency of the last ask/ask_stream: time to first token and total (s)
+        self.last_timing = {"ttft": None, "total": None}
 
     def prepare_context(self, text):
-        self.context_chunks = [c.strip() for c in text.split('\n\n') if len(c.strip()) > 50]
-        if not self.context_chunks:
-            self.context_chunks = [text]
-        self.chunk_embeddings = self.model.encode(self.context_chunks, convert_to_tensor=False)
+        self.prepare_context_pages([{"page": 1, "text": text, "start": 0}])
+
+    def load_context(self, chunks, embeddings):
+        # Restore a previously prepared context (e.g. from the result cache)
+        self.context_chunks = list(chunks)
+        self.chunk_hashes = [chunk_hash(chunk) for chunk in self.context_chunks]
+        self.chunk_embeddings = np.asarray(embeddings)
+        self._reset_metadata()
+        self.index = build_index(self.chunk_embeddings, self._backend_for(len(self.context_chunks)))
+
+    def attach_index(self, index, chunks):
+        # Share an already built (possibly memory-mapped) index, e.g. from an IndexStore
+        self.context_chunks = chunks
+        self.chunk_hashes = [chunk_hash(chunk) for chunk in chunks]
+        self.chunk_embeddings = None
+        self._reset_metadata()
+        self.index = index
+
+    def embeddings_by_hash(self):
+        """
+        Maps chunk hash -> embedding for the current context. With a shared
+        index attached (no float vectors of its own), they come from the
+        index when it stores them exactly, else from the embedding cache.
+        """
+        embeddings = self.chunk_embeddings
+        if embeddings is None and isinstance(self.index, ExactIndex):
+            embeddings = self.index.vectors
+        if embeddings is not None:
+            return dict(zip(self.chunk_hashes, embeddings))
+        if isinstance(self.index, IVFIndex):
+            # Rows are grouped by cluster; ids maps them back to chunks
+            return {self.chunk_hashes[i]: vector for i, vector in zip(self.index.ids, self.index.vectors)}
+        if self.embedding_cache is not None and self.chunk_hashes:
+            # Int8 codes only approximate the vectors, so they aren't reused
+            found = self.embedding_cache.get_many(self.chunk_hashes)
+            return {key: vector for key, vector in zip(self.chunk_hashes, found) if vector is not None}
+        return {}
+
+    def prepare_context_pages(self, pages, batch_size=64, previous=None):
+        """
+        Streaming variant of prepare_context for page records from
+        pdf_reader.iter_pdf_pages. Chunks are embedded in batches while pages
+        are still being parsed, so the full text is never assembled here.
+
+        Args:
+            pages: Page records from pdf_reader.iter_pdf_pages.
+            batch_size (int): Chunks per encode call.
+            previous (SemanticQA): Context of an earlier version of the same
+                document; chunks it already embedded are reused, not re-encoded.
+        """
+        reuse = previous.embeddings_by_hash() if previous is not None else None
+        chunks, _, hashes, embeddings = self._embed_stream(self._iter_page_chunks(pages), batch_size, reuse)
+        self.context_chunks = chunks
+        self.chunk_hashes = hashes
+        self.chunk_embeddings = embeddings
+        self._reset_metadata()
+        self.index = None
+        if chunks:
+            self.index = build_index(embeddings, self._backend_for(len(chunks)))
+
+    def add_document(self, doc_id, pages, title=None, batch_size=64):
+        """
+        Adds one document to the shared library corpus.
+
+        Args:
+            doc_id (str): Stable identifier (e.g. the document hash).
+            pages: Page records from pdf_reader.iter_pdf_pages.
+            title (str): Name shown in citations; defaults to doc_id.
+        """
+        if doc_id in self.documents:
+            return
+        # Registered only once its pages are read and embedded, so a failed
+        # parse can be retried
+        chunks, meta, hashes, embeddings = self._embed_stream(self._iter_page_chunks(pages, doc_id), batch_size)
+        self.documents[doc_id] = title or doc_id
+        doc_code = len(self.documents) - 1
+        if not chunks:
+            return
+
+        self.context_chunks.extend(chunks)
+        self.chunk_hashes.extend(hashes)
+        self.chunk_meta.extend(meta)
+        self._chunk_docs = np.concatenate([self._chunk_docs, np.full(len(chunks), doc_code)])
+        if self.chunk_embeddings is None:
+            self.chunk_embeddings = embeddings
+        else:
+            self.chunk_embeddings = np.vstack([self.chunk_embeddings, embeddings])
+
+        backend = self._backend_for(len(self.context_chunks))
+        if self.index is None or self.index.kind != backend:
+            self.index = build_index(self.chunk_embeddings, backend)
+        else:
+            self.index.add(embeddings)
+        self.bm25.add(chunks)
+        self._update_version()
+
+    def _iter_page_chunks(self, pages, doc_id=None):
+        # Yields (chunk, metadata); chunks of 50 characters or less are noise
+        # unless the whole document is that short
+        fallback = None
+        found = False
+        for chunk in iter_chunks(pages, self.chunk_tokens, self.chunk_overlap, self.page_aligned):
+            meta = {"doc_id": doc_id, "page": chunk["page"], "offset": chunk["start"]}
+            if len(chunk["text"]) > 50:
+                found = True
+                yield chunk["text"], meta
+            elif fallback is None:
+                fallback = (chunk["text"], meta)
+
+        if not found and fallback is not None:
+            yield fallback
+
+    def _embed_stream(self, pairs, batch_size, reuse=None):
+        # Encodes in batches of batch_size; chunks whose hash is in `reuse`
+        # take the stored vector instead
+        reuse = reuse or {}
+        chunks, meta, hashes, vectors = [], [], [], []
+        batch, batch_slots = [], []
+
+        def flush():
+            # Only chunks the embedding cache has never seen are encoded
+            keys = [hashes[slot] for slot in batch_slots]
+            with tracing.span("embedding.flush", chunks=len(batch)) as span:
+                found = [None] * len(batch)
+                if self.embedding_cache is not None:
+                    found = self.embedding_cache.get_many(keys)
+                missing = [i for i, vector in enumerate(found) if vector is None]
+                span.set(cache_hits=len(batch) - len(missing))
+                if missing:
+                    encoded = self.model.encode([batch[i] for i in missing], convert_to_tensor=False)
+                    for i, vector in zip(missing, encoded):
+                        found[i] = vector
+                    if self.embedding_cache is not None:
+                        self.embedding_cache.put_many([keys[i] for i in missing], encoded)
+            for slot, vector in zip(batch_slots, found):
+                vectors[slot] = vector
+            batch.clear()
+            batch_slots.clear()
 
-    def ask(self, question):
+        for chunk, chunk_meta in pairs:
+            key = chunk_hash(chunk)
+            chunks.append(chunk)
+            meta.append(chunk_meta)
+            hashes.append(key)
+            vectors.append(reuse.get(key))
+            if vectors[-1] is None:
+                batch.append(chunk)
+                batch_slots.append(len(vectors) - 1)
+                if len(batch) == batch_size:
+                    flush()
+        if batch:
+            flush()
+
+        self.reused_chunks = sum(1 for key in hashes if key in reuse)
+        embeddings = np.asarray(vectors, dtype=np.float32) if vectors else None
+        return chunks, meta, hashes, embeddings
+
+    def _backend_for(self, n_chunks):
+        if self.index_backend != "auto":
+            return self.index_backend
+        return "ivf" if n_chunks > IVF_THRESHOLD else "exact"
+
+    def _update_version(self):
+        digest = hashlib.sha1()
+        for key in self.chunk_hashes:
+            digest.update(key.encode("ascii"))
+        self.context_version = digest.hexdigest()
+
+    def _reset_metadata(self):
+        # The whole context was replaced: rebuild everything keyed by chunk id
+        self.bm25 = BM25Index(self.context_chunks)
+        self._update_version()
+        self.chunk_meta = [None] * len(self.context_chunks)
+        self.documents = {}
+        self._chunk_docs = np.full(len(self.context_chunks), -1, dtype=np.int64)
+
+    def _cite(self, chunk_id):
+        meta = self.chunk_meta[chunk_id] if chunk_id < len(self.chunk_meta) else None
+        if meta is None:
+            return ""
+        return f"{self.documents[meta['doc_id']]}, p. {meta['page']}"
+
+    def ask(self, question, doc_ids=None):
+        return "".join(self.ask_stream(question, doc_ids, stream=False))
+
+    def ask_stream(self, question, doc_ids=None, stream=True):
+        """
+        Answers a question, yielding the answer in pieces as the model
+        generates them; the sources footer comes last. Time to first token
+        and total latency are recorded in last_timing (seconds).
+
+        Args:
+            question (str): The user's question.
+            doc_ids (list): Library mode: only search these documents.
+            stream (bool): Request a streamed completion. With False the
+                answer arrives as one piece (used by ask).
+        """
+        started = time.perf_counter()
+        self.last_timing = {"ttft": None, "total": None}
+        first_piece = True
+        # The span is current only while an answer piece is being produced,
+        # never across a yield to the caller
+        span = tracing.tracer.start("qa.ask", stream=stream, chunks=len(self.context_chunks))
+        pieces = self._answer_pieces(question, doc_ids, stream)
+        try:
+            while True:
+                with tracing.tracer.activate(span):
+                    piece = next(pieces, None)
+                if piece is None:
+                    break
+                if first_piece:
+                    self.last_timing["ttft"] = time.perf_counter() - started
+                    span.set(ttft_s=self.last_timing["ttft"])
+                    first_piece = False
+                yield piece
+            self.last_timing["total"] = time.perf_counter() - started
+        finally:
+            pieces.close()
+            span.end()
+
+    def _answer_pieces(self, question, doc_ids, stream):
         if not self.context_chunks:
-            return "I'm sorry, I couldn't process the document content."
+            yield "I'm sorry, I couldn't process the document content."
+            return
+
+        # 1. Embed Question (an EmbeddingService batches it with other sessions' questions)
+        with tracing.span("embedding.query"):
+            if hasattr(self.model, "encode_query"):
+                query_vector = self.model.encode_query(question)
+            else:
+                query_vector = self.model.encode([question], convert_to_tensor=False)[0]
 
-        # 1. Embed Question
-        query_embedding = self.model.encode([question], convert_to_tensor=False)
+        # Library mode: restrict retrieval to the selected documents
+        mask = None
+        if doc_ids is not None:
+            wanted = set(doc_ids)
+            codes = [i for i, doc_id in enumerate(self.documents) if doc_id in wanted]
+            mask = np.isin(self._chunk_docs, codes)
 
-        # 2. Similarity Search (Dot Product)
-        scores = np.dot(self.chunk_embeddings, query_embedding.T).flatten()
+        # 2. Hybrid search: dense and BM25 rankings merged by reciprocal rank fusion
+        started = time.perf_counter()
+        with tracing.span("qa.search", index=getattr(self.index, "kind", ""), reranked=self.reranker is not None):
+            dense_ids, _ = self.index.search(query_vector, CANDIDATES, mask=mask)
+            sparse_ids, _ = self.bm25.search(question, CANDIDATES, mask=mask)
+            candidates = reciprocal_rank_fusion([dense_ids, sparse_ids])
+            if self.reranker is not None and len(candidates) > 1:
+                scores = self.reranker.predict([(question, self.context_chunks[i]) for i in candidates])
+                candidates = [candidates[i] for i in np.argsort(-np.asarray(scores), kind="stable")]
 
-        # 3. RETRIEVE TOP 3 MATCHES (Multi-Context Strategy)
-        # Instead of taking the single best, we take top 3 to give AI more info.
-        top_k_indices = np.argsort(scores)[::-1][:3]
+            # 3. Take the best matches until the context token budget is spent
+            top_k_indices = []
+            used_tokens = 0
+            for i in candidates[:self.max_sources]:
+                tokens = estimate_tokens(self.context_chunks[i])
+                if top_k_indices and used_tokens + tokens > self.context_token_budget:
+                    break
+                top_k_indices.append(i)
+                used_tokens += tokens
+        self.last_retrieval_ms = (time.perf_counter() - started) * 1000
+        if self.last_retrieval_ms > RETRIEVAL_BUDGET_MS:
+            tracing.metrics.inc("qa_retrieval_over_budget_total", index=getattr(self.index, "kind", ""))
+        if not top_k_indices:
+            yield "The selected documents do not contain any searchable text."
+            return
         best_contexts = [self.context_chunks[i] for i in top_k_indices]
+        citations = [self._cite(i) for i in top_k_indices]
 
         # 4. Combine Contexts
-        # We present all 3 pieces to the AI so it can synthesize the best answer
-        context_text = "\n\n".join([f"[Source {i+1}]: {ctx}" for i, ctx in enumerate(best_contexts)])
+        # We present every selected piece to the AI so it can synthesize the best answer
+        context_text = "\n\n".join([
+            f"[Source {i+1}]{f' ({cite})' if cite else ''}: {ctx}"
+            for i, (ctx, cite) in enumerate(zip(best_contexts, citations))
+        ])
+        sources_footer = ""
+        if any(citations):
+            sources_footer = "\n\nSOURCES: " + "; ".join(
+                f"[Source {i+1}] {cite}" for i, cite in enumerate(citations) if cite
+            )
+
+        user_content = f"Question: {question}\n\nContext Segments:\n{context_text}"
 
-        # 5. Generate Answer with System Instruction
+        # 5. Reuse an earlier answer to a paraphrase of this question over the
+        # same chunks, or to exactly this question over the same context
+        if self.answer_cache is not None:
+            answer = self.answer_cache.get(self.context_version, query_vector, top_k_indices)
+            if answer is not None:
+                yield answer + sources_footer
+                return
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(self.llm_model, SYSTEM_PROMPT, self.temperature, user_content)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                if self.answer_cache is not None:
+                    self.answer_cache.put(self.context_version, query_vector, top_k_indices, cached)
+                yield cached + sources_footer
+                return
+
+        # 6. Generate Answer with System Instruction
+        messages = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": user_content
+            }
+        ]
+        pieces = []
         try:
-            response = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a precise document analyzer. "
-                            "Answer the user's question based ONLY on the provided context segments."
-                            "\nINSTRUCTIONS:"
-                            "\n1. SYNTHESIZE: If information in Source 1 contradicts Source 2, reconcile it."
-                            "\n2. ACCURACY: If the answer is not in the context, say 'The text does not contain this information'."
-                            "\n3. COMPLETE: Provide a comprehensive answer using all sources."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Question: {question}\n\nContext Segments:\n{context_text}"
-                    }
-                ],
-                model='llama-3.1-8b-instant',
-                temperature=0.1, # Low temp for factual accuracy
-            )
-            return response.choices[0].message.content
+            if stream:
+                # Questions jump ahead of background summarization
+                for delta in self.gateway.chat_stream(
+                    messages=messages,
+                    model=self.llm_model,
+                    temperature=self.temperature,
+                    priority=PRIORITY_INTERACTIVE,
+                ):
+                    pieces.append(delta)
+                    yield delta
+            else:
+                response = self.gateway.chat(
+                    messages=messages,
+                    model=self.llm_model,
+                    temperature=self.temperature,
+                    priority=PRIORITY_INTERACTIVE,
+                )
+                pieces.append(response.choices[0].message.content)
+                yield pieces[0]
         except Exception as e:
-            return f"Error retrieving answer: {str(e)}"
\ No newline at end of file
+            # Part of the answer may already be on screen
+            yield f"{' ' if pieces else ''}Error retrieving answer: {str(e)}"
+            return
+
+        answer = "".join(pieces)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, answer)
+        if self.answer_cache is not None:
+            self.answer_cache.put(self.context_version, query_vector, top_k_indices, answer)
+        if sources_footer:
+            yield sources_footer
@@ -1,25 +1,188 @@
-from groq import Groq
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from llm_gateway import PRIORITY_BACKGROUND, get_gateway
+from chunker import chunk_hash, iter_chunks
+
+SYSTEM_PROMPT = (
+    "You are a STRICT Fact Extractor. "
+    "Extract ONLY concrete information from the provided text."
+    "\nSTRICT NEGATIVE RULES (Must Follow):"
+    "\n1. FORBIDDEN TOPICS: Do NOT write about 'Climate Change', 'Global Warming', 'Food Security', 'Greenhouse Gases' or 'Sustainability'."
+    "\n2. FORBIDDEN BEHAVIOR: Do NOT vent, ramble, or invent scenarios about these topics. If the text provided does NOT explicitly mention these topics, do NOT mention them."
+    "\n3. INTRODUCTIONS: If the text is just an introduction (e.g., 'This report outlines...'), return 'Introduction (No Data)'."
+    "\n4. FORMAT: Return ## [Section Name] and bullet points for facts."
+    "\n5. FACT-CHECK: Use ONLY facts explicitly stated in the text. Do not use outside knowledge."
+    "\n6. START: Begin immediately with the first '##' heading."
+)
+
+# Packed requests carry several chunks; the model answers part by part so the
+# response can be split back into one summary per chunk
+PACKED_SYSTEM_PROMPT = SYSTEM_PROMPT + (
+    "\n7. MULTIPLE PARTS: The text is divided into parts, each starting with a line '=== PART n ==='."
+    " Summarize every part separately and never merge parts."
+    " For each part, first output its '=== PART n ===' line unchanged, then that part's ## sections."
+)
+# Merges a group of summaries into one (a reduce step of summarize/reduce)
+REDUCE_SYSTEM_PROMPT = (
+    "You merge summaries of consecutive parts of one document into a single, shorter summary."
+    "\nRULES:"
+    "\n1. FORMAT: Return ## [Section Name] and bullet points for facts, like the input."
+    "\n2. MERGE: Combine sections about the same subject. Drop repetition and 'Introduction (No Data)' sections."
+    "\n3. FACT-CHECK: Use ONLY facts present in the input. Do not use outside knowledge."
+    "\n4. LENGTH: Keep the most important facts; the result must be much shorter than the input."
+    "\n5. START: Begin immediately with the first '##' heading."
+)
+PART_MARKER_RE = re.compile(r"^\s*=+\s*PART\s+(\d+)\s*=+\s*$", re.MULTILINE | re.IGNORECASE)
 
 class SemanticSummarizer:
-    def __init__(self, api_key):
-        self.client = Groq(api_key=api_key)
+    # Bump whenever the system prompt or chunking changes so cached summaries are invalidated
+    PROMPT_VERSION = 4
+
+    def __init__(self, api_key, max_workers=4, response_cache=None, pack_tokens=2000, gateway=None):
+        # Shared, rate-limited Groq access (see llm_gateway)
+        self.gateway = gateway or get_gateway(api_key)
         self.model = 'llama-3.1-8b-instant' 
-        self.chunk_size = 1800 
+        self.chunk_tokens = 450 # ~1800 characters
+        # Page-aligned chunks keep an edit from shifting every later chunk
+        self.page_aligned = True
+        # Chunk hashes in document order, and hash -> summary, for the last
+        # document passed to summarize_pages
+        self.chunk_hashes = []
+        self.chunk_summaries = {}
+        # Upper bound on chunk requests in flight at once (1 = sequential)
+        self.max_workers = max_workers
+        # Small chunks are packed into one request of up to this many input
+        # tokens, so the system prompt is paid once per pack (0 = no packing)
+        self.pack_tokens = pack_tokens
+        # Optional LLMResponseCache; safe to share since temperature is 0.0
+        self.response_cache = response_cache
+        # reduce() merges summaries level by level until the result is at
+        # most this long; each step merges about reduce_group_size summaries
+        self.reduce_target_chars = 6000
+        self.reduce_group_size = 6
+        # Merges that failed during the last reduce(); its result then still
+        # holds unmerged summaries and must not be cached
+        self.reduce_failures = 0
+        # Usage counters across every request this instance sent
+        self.requests = 0
+        self.total_tokens = 0
+        self._usage_lock = threading.Lock()
 
     def summarize(self, text):
         if not text:
             return "No text to summarize."
 
-        chunks = self._split_text(text)
-        
-        if len(chunks) == 1:
-            return self._summarize_chunk(chunks[0])
+        return self.reduce(self.summarize_chunks(text))
+
+    def summarize_chunks(self, text):
+        """Returns the raw per-chunk summaries, in document order."""
+        return list(self.summarize_pages([{"page": 1, "text": text, "start": 0}]))
+
+    def summarize_pages(self, pages, previous=None):
+        """
+        Streaming variant of summarize_chunks for page records from
+        pdf_reader.iter_pdf_pages. Chunks are dispatched while pages are still
+        being parsed and summaries are yielded in document order as soon as
+        they (and every summary before them) are ready.
+
+        Args:
+            pages: Page records from pdf_reader.iter_pdf_pages.
+            previous (dict): chunk_summaries of an earlier version of the
+                document; chunks whose hash appears there are not re-sent.
+        """
+        for kind, text in self.summarize_stream(pages, previous, stream=False):
+            if kind == "chunk":
+                yield text
+
+    def summarize_stream(self, pages, previous=None, stream=True):
+        """
+        Like summarize_pages, but also reports every ## section as soon as
+        the model has finished writing it.
+
+        Yields:
+            tuple: ("section", text) for each finished section, then
+            ("chunk", summary) once a chunk's whole summary is known. Both
+            arrive in document order.
+        """
+        previous = previous or {}
+        self.chunk_hashes = []
+        self.chunk_summaries = {}
+        chunks = iter_chunks(pages, self.chunk_tokens, page_aligned=self.page_aligned)
+        workers = max(1, self.max_workers)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            pack, pack_size = [], 0
+
+            for chunk in chunks:
+                sink = _ChunkSink(chunk_hash(chunk["text"]))
+                if sink.key in previous:
+                    sink.finish(previous[sink.key])
+                elif self.pack_tokens:
+                    if pack and pack_size + chunk["tokens"] > self.pack_tokens:
+                        self._submit_pack(executor, pack, stream)
+                        pack, pack_size = [], 0
+                    pack.append((chunk["text"], sink))
+                    pack_size += chunk["tokens"]
+                else:
+                    self._submit_pack(executor, [(chunk["text"], sink)], stream)
+                pending.append(sink)
+
+                # Bound the work queued ahead of the consumer. Chunks reused
+                # from `previous` can queue up behind the open pack, so the
+                # oldest pending chunk may be in it: send the pack before
+                # waiting on that chunk.
+                while len(pending) - len(pack) >= 2 * workers:
+                    if pack and pending[0] is pack[0][1]:
+                        self._submit_pack(executor, pack, stream)
+                        pack, pack_size = [], 0
+                    yield from self._drain(pending, block=True)
+                yield from self._drain(pending, block=False)
+
+            if pack:
+                self._submit_pack(executor, pack, stream)
+            while pending:
+                yield from self._drain(pending, block=True)
+
+    def _drain(self, pending, block):
+        # Passes on the events of the oldest unfinished chunk. With block=True,
+        # waits until that chunk is done; otherwise stops at the first chunk
+        # with nothing new to report.
+        while pending:
+            head = pending[0]
+            try:
+                kind, text = head.events.get(block=block)
+            except queue.Empty:
+                return
+            if kind == "section":
+                yield kind, text
+                continue
+            pending.popleft()
+            if not head.streamed:
+                for section in _sections(text):
+                    yield "section", section
+            yield kind, self._collect(head.key, text)
+            if block:
+                return
+
+    def _collect(self, key, summary_part):
+        self.chunk_hashes.append(key)
+        if not summary_part.startswith("Error:"):
+            self.chunk_summaries[key] = summary_part
+        return summary_part
+
+    def combine(self, summary_parts):
+        if len(summary_parts) == 1:
+            return summary_parts[0]
 
         detailed_summaries = []
         
-        for chunk in chunks:
-            summary_part = self._summarize_chunk(chunk)
-            
+        for summary_part in summary_parts:
             # If chunk returns empty or "No Data", skip it to keep summary clean
             if summary_part and len(summary_part) > 20:
                 detailed_summaries.append(summary_part)
@@ -30,55 +193,306 @@ class SemanticSummarizer:
         # Join with delimiter
         return "---TOPIC---".join(detailed_summaries)
 
-    def _summarize_chunk(self, text):
+    def reduce(self, summary_parts):
+        """
+        Hierarchical variant of combine for long documents: groups of
+        neighbouring summaries are merged in parallel by the model, and the
+        merged summaries again, until the result fits reduce_target_chars.
+        Short inputs are returned exactly as combine would.
+
+        Group boundaries depend on the content of the summaries, not their
+        position, and every merge is cached by its input, so after an edit
+        only the groups on the path from the changed chunks to the top are
+        merged again.
+        """
+        level = [part for part in summary_parts if part and len(part) > 20 and not part.startswith("Error:")]
+        workers = max(1, self.max_workers)
+        self.reduce_failures = 0
+        with tracing.span("summarize.reduce", parts=len(level)) as span:
+            reduce_group = tracing.tracer.wrap(self._reduce_group)
+            levels = 0
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                while len(level) > 1 and sum(len(part) for part in level) > self.reduce_target_chars:
+                    level = list(executor.map(reduce_group, self._reduce_groups(level)))
+                    levels += 1
+            span.set(levels=levels)
+        if not level:
+            return self.combine(summary_parts)
+        return self.combine(level)
+
+    def _reduce_groups(self, parts):
+        # Content-defined boundaries: a group ends after a summary whose hash
+        # hits 0 mod reduce_group_size, so inserting or editing a chunk
+        # moves at most the boundaries around it
+        size = max(2, self.reduce_group_size)
+        group = []
+        for part in parts:
+            group.append(part)
+            boundary = int(chunk_hash(part)[:8], 16) % size == 0
+            if len(group) >= 2 * size or (len(group) >= 2 and boundary):
+                yield group
+                group = []
+        if group:
+            yield group
+
+    def _reduce_group(self, group):
+        if len(group) == 1:
+            return group[0]
+
+        text = "\n\n".join(group)
+        cached = self._cache_get(text, REDUCE_SYSTEM_PROMPT)
+        if cached is not None:
+            return cached
+
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a STRICT Fact Extractor. "
-                            "Extract ONLY concrete information from the provided text."
-                            "\nSTRICT NEGATIVE RULES (Must Follow):"
-                            "\n1. FORBIDDEN TOPICS: Do NOT write about 'Climate Change', 'Global Warming', 'Food Security', 'Greenhouse Gases' or 'Sustainability'."
-                            "\n2. FORBIDDEN BEHAVIOR: Do NOT vent, ramble, or invent scenarios about these topics. If the text provided does NOT explicitly mention these topics, do NOT mention them."
-                            "\n3. INTRODUCTIONS: If the text is just an introduction (e.g., 'This report outlines...'), return 'Introduction (No Data)'."
-                            "\n4. FORMAT: Return ## [Section Name] and bullet points for facts."
-                            "\n5. FACT-CHECK: Use ONLY facts explicitly stated in the text. Do not use outside knowledge."
-                            "\n6. START: Begin immediately with the first '##' heading."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": text
-                    }
-                ],
-                model=self.model,
-                temperature=0.0, # Temperature 0 ensures AI is factual, not creative
+            merged = self._clean(self._complete(REDUCE_SYSTEM_PROMPT, text))
+        except Exception as e:
+            # Keep the unmerged summaries rather than losing them
+            print(f"Summary Reduce Error: {e}")
+            with self._usage_lock:
+                self.reduce_failures += 1
+            return text
+        self._cache_put(text, merged, REDUCE_SYSTEM_PROMPT)
+        return merged
+
+    def _submit_pack(self, executor, pack, stream=False):
+        def run():
+            sinks = [sink for _, sink in pack]
+            try:
+                with tracing.span("summarize.pack", chunks=len(pack)):
+                    results = self._summarize_pack([text for text, _ in pack], sinks if stream else None)
+            except Exception as e:
+                results = [f"Error: {str(e)}"] * len(pack)
+            for sink, result in zip(sinks, results):
+                sink.finish(result)
+
+        executor.submit(tracing.tracer.wrap(run))
+
+    def _summarize_pack(self, texts, sinks=None):
+        # Serve what we can from the cache; only the misses are sent. With
+        # sinks, sections are streamed to each chunk's sink as they arrive.
+        results = [None] * len(texts)
+        misses = []
+        for i, text in enumerate(texts):
+            cached = self._cache_get(text)
+            if cached is not None:
+                results[i] = cached
+            else:
+                misses.append(i)
+
+        if len(misses) == 1:
+            sink = sinks[misses[0]] if sinks else None
+            results[misses[0]] = self._summarize_chunk(texts[misses[0]], sink)
+        elif misses:
+            content = "\n\n".join(
+                f"=== PART {n} ===\n{texts[i]}" for n, i in enumerate(misses, start=1)
             )
-            raw_output = chat_completion.choices[0].message.content
-            
-            # Clean output: Strip anything before first Header
-            if "##" in raw_output:
-                return raw_output[raw_output.index("##"):]
-            return raw_output
+            try:
+                if sinks:
+                    part_sinks = {n: sinks[i] for n, i in enumerate(misses, start=1)}
+                    raw_output = self._complete_streamed(PACKED_SYSTEM_PROMPT, content, part_sinks)
+                else:
+                    raw_output = self._complete(PACKED_SYSTEM_PROMPT, content)
+                parts = self._split_parts(raw_output)
+            except Exception as e:
+                parts = {}
+                error = f"Error: {str(e)}"
+                for i in misses:
+                    results[i] = error
+
+            for n, i in enumerate(misses, start=1):
+                if results[i] is not None:
+                    continue
+                part = parts.get(n)
+                if part:
+                    results[i] = self._clean(part)
+                    self._cache_put(texts[i], results[i])
+                else:
+                    # The model skipped or mangled this part: ask for it alone
+                    sink = sinks[i] if sinks else None
+                    results[i] = self._summarize_chunk(texts[i], sink)
+
+        return results
+
+    @staticmethod
+    def _split_parts(raw_output):
+        markers = list(PART_MARKER_RE.finditer(raw_output))
+        parts = {}
+        for marker, following in zip(markers, markers[1:] + [None]):
+            end = following.start() if following else len(raw_output)
+            parts[int(marker.group(1))] = raw_output[marker.end():end].strip()
+        return parts
 
+    def _summarize_chunk(self, text, sink=None):
+        cached = self._cache_get(text)
+        if cached is not None:
+            return cached
+
+        try:
+            if sink is not None:
+                raw_output = self._complete_streamed(SYSTEM_PROMPT, text, {None: sink})
+            else:
+                raw_output = self._complete(SYSTEM_PROMPT, text)
+            raw_output = self._clean(raw_output)
         except Exception as e:
             return f"Error: {str(e)}"
 
-    def _split_text(self, text):
-        paragraphs = text.split('\n\n')
-        chunks = []
-        current_chunk = ""
+        self._cache_put(text, raw_output)
+        return raw_output
 
-        for para in paragraphs:
-            if len(current_chunk) + len(para) < self.chunk_size:
-                current_chunk += "\n\n" + para
-            else:
-                chunks.append(current_chunk.strip())
-                current_chunk = para
-        
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
-            
-        return chunks
\ No newline at end of file
+    def _complete(self, system_prompt, text):
+        chat_completion = self.gateway.chat(
+            messages=[
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": text
+                }
+            ],
+            model=self.model,
+            temperature=0.0, # Temperature 0 ensures AI is factual, not creative
+            priority=PRIORITY_BACKGROUND,
+        )
+        usage = getattr(chat_completion, "usage", None)
+        with self._usage_lock:
+            self.requests += 1
+            if usage is not None:
+                self.total_tokens += usage.total_tokens or 0
+        return chat_completion.choices[0].message.content
+
+    def _complete_streamed(self, system_prompt, text, sinks):
+        # Streams the completion, handing each finished ## section to the sink
+        # of its part (key None when the request is not packed)
+        splitter = _SectionSplitter()
+        pieces = []
+
+        def route(part, section):
+            sink = sinks.get(part)
+            if sink is not None:
+                sink.section(section)
+
+        usage = {}
+        for delta in self.gateway.chat_stream(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text},
+            ],
+            model=self.model,
+            temperature=0.0,
+            priority=PRIORITY_BACKGROUND,
+            usage_out=usage,
+        ):
+            pieces.append(delta)
+            for part, section in splitter.feed(delta):
+                route(part, section)
+        for part, section in splitter.close():
+            route(part, section)
+
+        with self._usage_lock:
+            self.requests += 1
+            self.total_tokens += usage.get("total_tokens", 0)
+        return "".join(pieces)
+
+    @staticmethod
+    def _clean(raw_output):
+        # Clean output: Strip anything before first Header
+        if "##" in raw_output:
+            return raw_output[raw_output.index("##"):]
+        return raw_output
+
+    def _cache_get(self, text, system_prompt=SYSTEM_PROMPT):
+        # Packed and single requests share one per-chunk cache entry. The
+        # cache is best effort: an error (e.g. "database is locked" while
+        # another process writes) counts as a miss
+        if self.response_cache is None:
+            return None
+        try:
+            return self.response_cache.get(self.response_cache.make_key(self.model, system_prompt, 0.0, text))
+        except Exception as e:
+            print(f"Summary Cache Error: {e}")
+            return None
+
+    def _cache_put(self, text, summary_part, system_prompt=SYSTEM_PROMPT):
+        # A failed write only costs a request next time, never the summary
+        if self.response_cache is None:
+            return
+        try:
+            self.response_cache.put(self.response_cache.make_key(self.model, system_prompt, 0.0, text), summary_part)
+        except Exception as e:
+            print(f"Summary Cache Error: {e}")
+
+
+class _ChunkSink:
+    """Event queue of one chunk: its sections as they stream in, then the summary."""
+
+    def __init__(self, key):
+        self.key = key
+        self.events = queue.Queue()
+        # True once a section was reported; the consumer then skips
+        # re-splitting the final summary
+        self.streamed = False
+
+    def section(self, text):
+        self.streamed = True
+        self.events.put(("section", text))
+
+    def finish(self, summary):
+        self.events.put(("chunk", summary))
+
+
+class _SectionSplitter:
+    """
+    Cuts streamed model output into ## sections. A section is complete when
+    the next one (or a '=== PART n ===' marker, or the end) begins. Text
+    before a part's first heading is dropped, as in _clean.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.part = None
+        self.lines = None
+
+    def feed(self, delta):
+        self.buffer += delta
+        finished = []
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self._line(line + "\n", finished)
+        return finished
+
+    def close(self):
+        finished = []
+        if self.buffer:
+            self._line(self.buffer, finished)
+            self.buffer = ""
+        self._flush(finished)
+        return finished
+
+    def _line(self, line, finished):
+        marker = PART_MARKER_RE.match(line)
+        if marker:
+            self._flush(finished)
+            self.part = int(marker.group(1))
+        elif line.lstrip().startswith("##"):
+            self._flush(finished)
+            self.lines = [line]
+        elif self.lines is not None:
+            self.lines.append(line)
+
+    def _flush(self, finished):
+        if self.lines:
+            section = "".join(self.lines).strip()
+            if section:
+                finished.append((self.part, section))
+        self.lines = None
+
+
+def _sections(summary):
+    # Splits a finished summary into its ## sections
+    starts = [m.start() for m in re.finditer(r"^[ \t]*##", summary, re.MULTILINE)]
+    if not starts:
+        return [summary] if summary.strip() else []
+    return [summary[a:b].strip() for a, b in zip(starts, starts[1:] + [len(summary)])]
@@ -0,0 +1,42 @@
+import numpy as np
+
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "Gradient descent updates the weights along the negative gradient.",
+    "Entropy measures the uncertainty of a random variable.",
+    "The course code CS-101 covers tf_idf and h2o examples.",
+    "Cross entropy compares two distributions; entropy appears twice here.",
+]
+
+
+def test_tokenize_keeps_codes_whole():
+    assert tokenize("CS-101 uses tf_idf, H2O and f1.5.") == ["cs-101", "uses", "tf_idf", "h2o", "and", "f1.5"]
+
+
+def test_search_ranks_matching_texts_and_skips_the_rest():
+    index = BM25Index(TEXTS)
+    ids, scores = index.search("entropy", 10)
+
+    assert ids.tolist() == [3, 1]
+    assert scores[0] > scores[1] > 0
+    assert index.search("cs-101", 3)[0].tolist() == [2]
+    assert len(index.search("photosynthesis", 3)[0]) == 0
+
+
+def test_add_matches_a_full_build():
+    grown = BM25Index(TEXTS[:2])
+    grown.add(TEXTS[2:])
+    built = BM25Index(TEXTS)
+
+    np.testing.assert_allclose(grown.scores("entropy gradient"), built.scores("entropy gradient"))
+
+
+def test_search_respects_mask():
+    index = BM25Index(TEXTS)
+    mask = np.array([True, True, True, False])
+    assert index.search("entropy", 10, mask=mask)[0].tolist() == [1]
+
+
+def test_reciprocal_rank_fusion_prefers_ids_ranked_by_both():
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]]) == [1, 3, 2, 4]
@@ -0,0 +1,150 @@
+import os
+import time
+
+import numpy as np
+
+import cache
+from cache import EmbeddingCache, LLMResponseCache, ResultCache, SemanticAnswerCache
+
+
+class Clock:
+    """Replaces time.time in cache so TTLs can be crossed without sleeping."""
+
+    def __init__(self, monkeypatch):
+        self.now = 1_000_000.0
+        monkeypatch.setattr(cache.time, "time", lambda: self.now)
+
+
+def _put_result(results, key, rows=64):
+    results.put(key, "text", ["## Summary\n- fact"], [("topic", 1.0)], ["chunk"] * rows,
+                np.zeros((rows, 384), dtype=np.float32), summary="## Summary")
+
+
+def test_result_cache_round_trip(tmp_path):
+    results = ResultCache(directory=str(tmp_path))
+    _put_result(results, "doc")
+
+    entry = results.get("doc")
+    assert entry["summary"] == "## Summary"
+    assert entry["keywords"] == [["topic", 1.0]]
+    assert entry["embeddings"].shape == (64, 384)
+    assert results.get("other") is None
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    evicted = []
+    entry_bytes = 64 * 384 * 4
+    results = ResultCache(directory=str(tmp_path), max_bytes=int(2.5 * entry_bytes), on_evict=evicted.append)
+    _put_result(results, "a")
+    _put_result(results, "b")
+    past = time.time() - 60
+    os.utime(os.path.join(results.directory, "a"), (past, past))
+    os.utime(os.path.join(results.directory, "b"), (past, past))
+    results.get("a")
+    _put_result(results, "c")
+
+    assert evicted == ["b"]
+    assert results.get("b") is None
+    assert results.get("a") is not None
+
+
+def test_result_cache_get_survives_concurrent_eviction(tmp_path, monkeypatch):
+    results = ResultCache(directory=str(tmp_path))
+    _put_result(results, "doc")
+
+    def evicted(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(cache.os, "utime", evicted)
+    assert results.get("doc") is not None
+
+
+def test_response_cache_expires_after_ttl(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    responses = LLMResponseCache(path=str(tmp_path / "responses.sqlite3"), ttl=60)
+    responses.put("key", "value")
+    assert responses.get("key") == "value"
+
+    clock.now += 61
+    assert responses.get("key") is None
+    # The SQLite tier expires too, not only the in-process one
+    fresh = LLMResponseCache(path=str(tmp_path / "responses.sqlite3"), ttl=60)
+    assert fresh.get("key") is None
+
+
+def test_response_cache_memory_tier_is_lru(tmp_path):
+    responses = LLMResponseCache(path=str(tmp_path / "responses.sqlite3"), memory_entries=2)
+    for key in ("a", "b", "c"):
+        responses.put(key, key.upper())
+
+    assert list(responses._memory) == ["b", "c"]
+    # Still served from SQLite, and brought back into memory
+    assert responses.get("a") == "A"
+    assert responses.memory_hits == 0
+    assert list(responses._memory) == ["c", "a"]
+
+
+def test_response_cache_trims_least_recently_used_rows(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    responses = LLMResponseCache(path=str(tmp_path / "responses.sqlite3"), memory_entries=1, max_rows=50)
+    for n in range(100):
+        clock.now += 1
+        responses.put(f"key-{n}", str(n))
+        if n == 80:
+            clock.now += 1
+            responses.get("key-0")
+
+    (rows,) = responses._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+    assert rows == 50
+    # Reading key-0 late kept it over key-50, the oldest by access
+    assert responses.get("key-0") == "0"
+    assert responses.get("key-50") is None
+    assert responses.get("key-51") == "51"
+
+
+def test_embedding_cache_round_trip_and_slot_reuse(tmp_path):
+    embeddings = EmbeddingCache("model", 8, directory=str(tmp_path), max_entries=10)
+    vectors = np.eye(8, dtype=np.float32)
+    embeddings.put_many([f"k{i}" for i in range(8)], vectors)
+
+    found = embeddings.get_many(["k3", "missing"])
+    np.testing.assert_allclose(found[0], vectors[3], atol=1e-3)
+    assert found[1] is None
+    assert embeddings.stats()["hits"] == 1
+
+    # Past max_entries the oldest are dropped and their rows handed out again
+    embeddings.put_many([f"n{i}" for i in range(5)], np.ones((5, 8), dtype=np.float32))
+    entries = embeddings.stats()["entries"]
+    assert entries <= 10
+    (next_slot,) = embeddings._db.execute("SELECT value FROM slots WHERE name = 'next'").fetchone()
+    assert next_slot <= 13
+    assert embeddings.get_many(["n4"])[0] is not None
+
+
+def test_embedding_cache_instances_share_rows_safely(tmp_path):
+    # Two handles on one directory stand in for two processes
+    first = EmbeddingCache("model", 4, directory=str(tmp_path))
+    second = EmbeddingCache("model", 4, directory=str(tmp_path))
+    first.put_many(["a"], [np.full(4, 1.0)])
+    second.put_many(["b"], [np.full(4, 2.0)])
+    # Grows the file past the first handle's mapping
+    second.put_many([f"x{i}" for i in range(3000)], np.full((3000, 4), 3.0))
+
+    a, b, last = first.get_many(["a", "b", "x2999"])
+    assert a.tolist() == [1.0] * 4
+    assert b.tolist() == [2.0] * 4
+    assert last.tolist() == [3.0] * 4
+
+
+def test_answer_cache_matches_paraphrases_until_ttl(monkeypatch):
+    clock = Clock(monkeypatch)
+    answers = SemanticAnswerCache(threshold=0.9, ttl=60)
+    answers.put("ctx", [1.0, 0.0], [1, 2], "answer")
+
+    assert answers.get("ctx", [0.99, 0.05], [1, 2]) == "answer"
+    # Same meaning but different retrieved chunks, or another context
+    assert answers.get("ctx", [0.99, 0.05], [1, 3]) is None
+    assert answers.get("other", [1.0, 0.0], [1, 2]) is None
+
+    clock.now += 61
+    assert answers.get("ctx", [1.0, 0.0], [1, 2]) is None
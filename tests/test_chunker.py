@@ -0,0 +1,88 @@
+from chunker import CHARS_PER_TOKEN, chunk_hash, chunk_text, estimate_tokens, iter_chunks
+
+
+def _pages(texts):
+    pages, offset = [], 0
+    for number, text in enumerate(texts, start=1):
+        pages.append({"page": number, "text": text, "start": offset, "end": offset + len(text)})
+        offset += len(text) + 1
+    return pages, "\n".join(texts)
+
+
+def _sentences(count, word="topic"):
+    return " ".join(f"Sentence {n} talks about the {word} in some detail." for n in range(count))
+
+
+def test_chunks_respect_the_token_limit_and_end_at_sentences():
+    chunks = chunk_text(_sentences(200), max_tokens=100)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk["tokens"] <= 100
+        assert chunk["text"].endswith(".")
+        assert chunk["text"].startswith("Sentence")
+
+
+def test_overlong_sentence_is_cut_at_whitespace():
+    text = " ".join(["word"] * 400) + "."
+    chunks = chunk_text(text, max_tokens=50)
+
+    assert len(chunks) > 1
+    assert all(len(chunk["text"]) <= 50 * CHARS_PER_TOKEN for chunk in chunks)
+    assert all(not chunk["text"].startswith(" ") for chunk in chunks)
+    assert " ".join(chunk["text"] for chunk in chunks) == text
+
+
+def test_headings_start_a_new_chunk():
+    text = "\n".join([
+        "Chapter 1 Foundations",
+        _sentences(20),
+        "Chapter 2 Applications",
+        _sentences(20, word="application"),
+    ])
+    chunks = chunk_text(text, max_tokens=1000)
+
+    assert [chunk["text"].splitlines()[0] for chunk in chunks] == ["Chapter 1 Foundations", "Chapter 2 Applications"]
+
+
+def test_overlap_repeats_trailing_sentences():
+    chunks = chunk_text(_sentences(60), max_tokens=100, overlap_tokens=30)
+
+    assert len(chunks) > 2
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk["start"] < previous["end"]
+        repeated = previous["text"][chunk["start"] - previous["start"]:]
+        assert chunk["text"].startswith(repeated)
+        assert 0 < estimate_tokens(repeated) <= 30
+
+
+def test_offsets_and_pages_point_back_into_the_document():
+    pages, document = _pages([_sentences(30, word=f"page{n}") for n in range(1, 5)])
+    chunks = list(iter_chunks(pages, max_tokens=120))
+
+    assert any(chunk["page"] != chunk["end_page"] for chunk in chunks)
+    for chunk in chunks:
+        first_line = chunk["text"].split("\n")[0]
+        assert document[chunk["start"]:].startswith(first_line)
+        assert document[:chunk["end"]].endswith(chunk["text"].split("\n")[-1])
+        page = pages[chunk["page"] - 1]
+        assert page["start"] <= chunk["start"] < page["end"]
+
+
+def test_page_aligned_chunks_keep_other_pages_stable():
+    texts = [_sentences(15, word=f"page{n}") for n in range(1, 6)]
+    edited = list(texts)
+    edited[2] = _sentences(18, word="rewritten")
+
+    before = list(iter_chunks(_pages(texts)[0], max_tokens=120, page_aligned=True))
+    after = list(iter_chunks(_pages(edited)[0], max_tokens=120, page_aligned=True))
+
+    assert all(chunk["page"] == chunk["end_page"] for chunk in before + after)
+    unchanged = {chunk_hash(c["text"]) for c in before if c["page"] != 3}
+    assert unchanged == {chunk_hash(c["text"]) for c in after if c["page"] != 3}
+
+
+def test_chunk_hash_ignores_whitespace():
+    assert chunk_hash("a  b\nc") == chunk_hash(" a b c ")
+    assert chunk_hash("a b c") != chunk_hash("a b d")
+    assert estimate_tokens("x" * 9) == 3
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import threading
+import zlib
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from embed_server import EmbeddingClient, EmbeddingServer
+
+
+class FakeModel:
+    """EmbeddingService stand-in: one-hot rows from a hash of each text."""
+
+    name = "fake"
+    dim = 32
+    signature = "fake|torch|fp32"
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        if "explode" in texts:
+            raise ValueError("model failure")
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            out[row, zlib.crc32(text.encode("utf-8")) % self.dim] = 1.0
+        return out
+
+
+@pytest.fixture
+def server():
+    # Unix socket paths are short; pytest's tmp_path can exceed the limit
+    directory = tempfile.mkdtemp(prefix="embed-")
+    server = EmbeddingServer(FakeModel(), os.path.join(directory, "embed.sock"), wait_ms=20)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    os.unlink(server.server_address)
+    os.rmdir(directory)
+
+
+def test_client_mirrors_the_model(server):
+    client = EmbeddingClient(server.server_address, timeout=5)
+    try:
+        assert (client.name, client.dim, client.signature) == ("fake", 32, "fake|torch|fp32")
+
+        texts = ["alpha", "beta", "gamma"]
+        first = client.encode(texts)
+        np.testing.assert_array_equal(first, FakeModel().encode(texts))
+        # The caller owns its rows: the next call reuses the shared buffer
+        client.encode(["delta"] * 3)
+        np.testing.assert_array_equal(first, FakeModel().encode(texts))
+
+        assert client.encode([]).shape == (0, 32)
+        np.testing.assert_array_equal(client.encode_query("alpha"), first[0])
+    finally:
+        client.close()
+
+
+def test_buffer_grows_for_large_requests(server):
+    client = EmbeddingClient(server.server_address, timeout=5)
+    try:
+        texts = [f"text {n}" for n in range(1000)]
+        np.testing.assert_array_equal(client.encode(texts), FakeModel().encode(texts))
+    finally:
+        client.close()
+
+
+def test_concurrent_callers_share_forward_passes(server):
+    client = EmbeddingClient(server.server_address, timeout=5, max_connections=4)
+    barrier = threading.Barrier(4, timeout=5)
+    results = {}
+
+    def call(n):
+        texts = [f"caller {n} text {i}" for i in range(5)]
+        barrier.wait()
+        results[n] = (texts, client.encode(texts))
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+    finally:
+        client.close()
+
+    for texts, vectors in results.values():
+        np.testing.assert_array_equal(vectors, FakeModel().encode(texts))
+    assert len(results) == 4
+    assert server.stats["requests"] == 4
+    assert server.stats["batches"] < 4
+    assert client._idle.qsize() == 0
+
+
+def test_model_errors_reach_the_caller(server):
+    client = EmbeddingClient(server.server_address, timeout=5)
+    try:
+        with pytest.raises(RuntimeError, match="model failure"):
+            client.encode(["explode"])
+        assert client.encode(["fine"]).shape == (1, 32)
+    finally:
+        client.close()
+
+
+def test_close_unlinks_shared_segments(server):
+    client = EmbeddingClient(server.server_address, timeout=5, max_connections=2)
+    client.encode(["alpha"])
+    names = [connection.shm.name for connection in list(client._idle.queue)]
+    client.close()
+
+    assert names
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    # Calls finishing after close() don't return their connection to the pool
+    client.encode(["beta"])
+    assert client._idle.qsize() == 0
@@ -0,0 +1,182 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_gateway
+from llm_gateway import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, LLMGateway, TokenBucket
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+class FakeStream:
+    """Stands in for groq's Stream: iterable deltas plus close()."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.closed = False
+
+    def __iter__(self):
+        for piece in self.pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], x_groq=None)
+
+    def close(self):
+        self.closed = True
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("Rate limit reached")
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class BadRequestError(Exception):
+    status_code = 400
+
+
+class ScriptedClient:
+    """Raises the scripted errors in turn, then answers with the prompt."""
+
+    def __init__(self, errors=()):
+        self.chat = SimpleNamespace(completions=self)
+        self.errors = list(errors)
+        self.calls = []
+
+    def create(self, messages, model, **kwargs):
+        self.calls.append((time.monotonic(), messages[0]["content"]))
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=messages[0]["content"]))], usage=None)
+
+
+class BlockingClient(ScriptedClient):
+    """The first call waits for `release`, holding the only concurrency slot."""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def create(self, messages, model, **kwargs):
+        if not self.entered.is_set():
+            self.entered.set()
+            self.release.wait(5)
+        return super().create(messages, model, **kwargs)
+
+
+class StreamingClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+        self.streams = []
+
+    def create(self, messages, model, stream=False, **kwargs):
+        self.streams.append(FakeStream(["a", "b", "c"]))
+        return self.streams[-1]
+
+
+def test_abandoned_stream_is_closed():
+    client = StreamingClient()
+    gateway = LLMGateway(client=client)
+    stream = gateway.chat_stream(MESSAGES, "model")
+    assert next(stream) == "a"
+    stream.close()
+
+    assert client.streams[0].closed
+    # The concurrency slot was given back
+    assert "".join(gateway.chat_stream(MESSAGES, "model")) == "abc"
+    assert gateway._in_flight == 0
+
+
+def _wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_interactive_requests_overtake_background_ones():
+    client = BlockingClient()
+    gateway = LLMGateway(client=client, max_concurrency=1)
+
+    def call(content, priority):
+        gateway.chat([{"role": "user", "content": content}], "model", priority=priority)
+
+    threads = [threading.Thread(target=call, args=("first", PRIORITY_BACKGROUND))]
+    threads[0].start()
+    client.entered.wait(5)
+    for content, priority in [("background", PRIORITY_BACKGROUND), ("interactive", PRIORITY_INTERACTIVE)]:
+        threads.append(threading.Thread(target=call, args=(content, priority)))
+        threads[-1].start()
+        _wait_for(lambda: len(gateway._waiting) == len(threads) - 1)
+
+    client.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert [content for _, content in client.calls] == ["first", "interactive", "background"]
+    assert gateway._in_flight == 0 and not gateway._waiting
+
+
+def test_rate_limit_waits_for_retry_after(monkeypatch):
+    # No jitter: the wait is exactly Retry-After
+    monkeypatch.setattr(llm_gateway.random, "uniform", lambda low, high: low)
+    client = ScriptedClient([RateLimitError(0.05), RateLimitError(0.05)])
+    gateway = LLMGateway(client=client, base_delay=0.001)
+
+    response = gateway.chat(MESSAGES, "model")
+
+    assert response.choices[0].message.content == "Hello"
+    assert len(client.calls) == 3
+    assert all(later - earlier >= 0.05 for (earlier, _), (later, _) in zip(client.calls, client.calls[1:]))
+    assert gateway.stats["retries"] == 2
+    assert gateway.stats["rate_limited"] == 2
+    assert gateway.stats["failures"] == 0
+
+
+def test_rate_limit_pauses_other_callers(monkeypatch):
+    monkeypatch.setattr(llm_gateway.random, "uniform", lambda low, high: low)
+    monkeypatch.setattr(llm_gateway.time, "sleep", lambda seconds: None)
+    gateway = LLMGateway(client=ScriptedClient([RateLimitError(0.1)]))
+
+    gateway.chat(MESSAGES, "model")
+
+    # The retry itself had to wait out the shared block, not just this caller's sleep
+    assert gateway.stats["queue_wait"] >= 0.09
+
+
+def test_client_errors_are_not_retried():
+    client = ScriptedClient([BadRequestError("bad request")])
+    gateway = LLMGateway(client=client)
+
+    with pytest.raises(BadRequestError):
+        gateway.chat(MESSAGES, "model")
+    assert len(client.calls) == 1
+    assert gateway.stats["retries"] == 0
+    assert gateway.stats["failures"] == 1
+    assert gateway._in_flight == 0
+
+
+def test_retries_give_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(llm_gateway.time, "sleep", lambda seconds: None)
+    client = ScriptedClient([RateLimitError(0)] * 5)
+    gateway = LLMGateway(client=client, max_retries=2)
+
+    with pytest.raises(RateLimitError):
+        gateway.chat(MESSAGES, "model")
+    assert len(client.calls) == 3
+    assert gateway.stats["retries"] == 2
+    assert gateway.stats["failures"] == 1
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(60)
+    assert bucket.delay_for(60, now=bucket.updated) == 0.0
+
+    bucket.consume(60, now=bucket.updated)
+    assert bucket.delay_for(10, now=bucket.updated) == pytest.approx(10.0)
+    assert bucket.delay_for(10, now=bucket.updated + 5) == pytest.approx(5.0)
+    # Larger than the whole bucket: wait for a full one, not forever
+    assert bucket.delay_for(600, now=bucket.updated) == pytest.approx(55.0)
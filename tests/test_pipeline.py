@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+from jobs import CANCELLED, FAILED, JobCancelled, JobManager
+from pipeline import PageFeed, StageGraph
+
+
+def _wait_until_done(manager, job_id):
+    deadline = time.monotonic() + 5
+    while not manager.get(job_id).done:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    return manager.get(job_id)
+
+
+def test_stages_receive_their_dependencies_outputs():
+    graph = StageGraph()
+    graph.add("a", lambda: 2)
+    graph.add("b", lambda: 3)
+    graph.add("product", lambda a, b: a * b, deps=("a", "b"))
+    graph.add("label", lambda product: f"= {product}", deps=("product",))
+    ready = []
+
+    outputs = graph.run(on_ready=lambda name, value: ready.append(name))
+
+    assert outputs == {"a": 2, "b": 3, "product": 6, "label": "= 6"}
+    assert sorted(ready) == ["a", "b", "label", "product"]
+    assert ready.index("product") < ready.index("label")
+
+
+def test_unsatisfiable_dependencies_are_rejected():
+    graph = StageGraph()
+    graph.add("orphan", lambda missing: missing, deps=("missing",))
+
+    with pytest.raises(ValueError, match="orphan"):
+        graph.run()
+
+
+def test_stage_error_stops_dependents_and_siblings():
+    graph = StageGraph()
+    ran = []
+    sibling_stopped = threading.Event()
+
+    def broken():
+        raise KeyError("boom")
+
+    def long_running():
+        # Polls graph.failed like the pipeline's checkpoint()
+        while not graph.failed.wait(0.005):
+            pass
+        sibling_stopped.set()
+        raise JobCancelled()
+
+    graph.add("broken", broken)
+    graph.add("dependent", lambda value: ran.append(value), deps=("broken",))
+    graph.add("sibling", long_running)
+
+    with pytest.raises(KeyError, match="boom"):
+        graph.run()
+    # The original error wins over the cancellation it caused, and run()
+    # only returned once the sibling had stopped
+    assert sibling_stopped.is_set()
+    assert ran == []
+
+
+def test_cancelled_job_stops_every_stage():
+    manager = JobManager(max_workers=1)
+    started = threading.Barrier(3, timeout=5)
+    stopped = []
+
+    def stage(job, graph, name):
+        started.wait()
+        while True:
+            job.check_cancelled()
+            if graph.failed.is_set():
+                stopped.append(name)
+                raise JobCancelled()
+            time.sleep(0.005)
+
+    def run(job):
+        graph = StageGraph()
+        graph.add("reader", lambda: stage(job, graph, "reader"))
+        graph.add("summary", lambda: stage(job, graph, "summary"))
+        graph.add("after", lambda summary: stopped.append("after"), deps=("summary",))
+        return graph.run()
+
+    job_id = manager.submit(run)
+    started.wait()
+    assert manager.cancel(job_id)
+    job = _wait_until_done(manager, job_id)
+
+    assert job.status == CANCELLED
+    assert job.result is None
+    assert "after" not in stopped
+
+
+def test_failed_stage_fails_the_job():
+    manager = JobManager(max_workers=1)
+
+    def run(job):
+        graph = StageGraph()
+        graph.add("pages", lambda: 1 / 0)
+        return graph.run()
+
+    job = _wait_until_done(manager, manager.submit(run))
+    assert job.status == FAILED
+    assert "division by zero" in job.error
+
+
+def test_page_feed_serves_concurrent_readers():
+    feed = PageFeed()
+    seen = {0: [], 1: []}
+
+    def consume(reader):
+        seen[reader].extend(record["page"] for record in feed)
+
+    readers = [threading.Thread(target=consume, args=(n,)) for n in seen]
+    for reader in readers:
+        reader.start()
+    for page in range(1, 6):
+        feed.append({"page": page, "text": "x"})
+    feed.close()
+    for reader in readers:
+        reader.join(5)
+
+    assert seen == {0: [1, 2, 3, 4, 5], 1: [1, 2, 3, 4, 5]}
+
+
+def test_page_feed_propagates_read_errors():
+    feed = PageFeed()
+    feed.append({"page": 1, "text": "x"})
+    feed.close(OSError("truncated PDF"))
+
+    pages = iter(feed)
+    assert next(pages)["page"] == 1
+    with pytest.raises(RuntimeError) as info:
+        next(pages)
+    assert isinstance(info.value.__cause__, OSError)
@@ -0,0 +1,64 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from cache import EmbeddingCache
+from qa import SemanticQA
+from vector_index import IndexStore
+
+
+class CountingEmbedder:
+    """Hashing-trick embedder that records how many texts it encoded."""
+
+    dim = 64
+    signature = "counting"
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts, convert_to_tensor=False):
+        self.encoded += len(texts)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                out[row, zlib.crc32(token.encode("utf-8")) % self.dim] += 1.0
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-9)
+        return out
+
+
+def _pages(texts):
+    pages, offset = [], 0
+    for number, text in enumerate(texts, start=1):
+        pages.append({"page": number, "text": text, "start": offset, "end": offset + len(text)})
+        offset += len(text) + 1
+    return pages
+
+
+def _texts(n, edited=()):
+    texts = []
+    for page in range(1, n + 1):
+        word = "rewritten" if page in edited else "original"
+        texts.append(f"Page {page} is the {word} discussion of topic {page}, with sentences about subject {page}.")
+    return texts
+
+
+@pytest.mark.parametrize("backend", ["ivf", "int8"])
+def test_reupload_after_restore_reembeds_only_changed_chunks(tmp_path, backend):
+    model = CountingEmbedder()
+    embedding_cache = EmbeddingCache(model.signature, model.dim, directory=str(tmp_path))
+    first = SemanticQA(model, None, index_backend=backend, gateway=object(), embedding_cache=embedding_cache)
+    first.prepare_context_pages(_pages(_texts(12)))
+    store = IndexStore(directory=str(tmp_path))
+    store.put("doc", first.index, first.context_chunks)
+
+    # A later session restores the document from the store, then the user
+    # uploads a version with two pages edited
+    restored = SemanticQA(model, None, index_backend=backend, gateway=object(), embedding_cache=embedding_cache)
+    restored.attach_index(*store.get("doc"))
+    model.encoded = 0
+    edited = SemanticQA(model, None, index_backend=backend, gateway=object())
+    edited.prepare_context_pages(_pages(_texts(12, edited={3, 7})), previous=restored)
+
+    assert model.encoded == 2
+    assert len(edited.context_chunks) == 12
@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from llm_gateway import LLMGateway
+from summarizer import PART_MARKER_RE, REDUCE_SYSTEM_PROMPT, SemanticSummarizer
+
+
+class FakeGateway:
+    """Answers every request at once with one summary per packed part."""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def chat(self, messages, model, **kwargs):
+        with self._lock:
+            self.calls += 1
+        text = messages[-1]["content"]
+        parts = PART_MARKER_RE.findall(text)
+        if parts:
+            content = "\n".join(f"=== PART {n} ===\n## Part {n}\n- A summarized fact." for n in parts)
+        else:
+            content = "## Summary\n- A summarized fact about the chunk."
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=10, total_tokens=20)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class FakeStreamingClient:
+    """groq.Groq stand-in whose streams report usage on the final chunk, like Groq."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, messages, model, stream=False, **kwargs):
+        assert stream
+        return self._stream(FakeGateway().chat(messages, model).choices[0].message.content)
+
+    @staticmethod
+    def _stream(content):
+        for start in range(0, len(content), 16):
+            delta = SimpleNamespace(content=content[start:start + 16])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], x_groq=None)
+        usage = SimpleNamespace(prompt_tokens=30, completion_tokens=12, total_tokens=42)
+        yield SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=usage))
+
+
+def _pages(texts):
+    pages, offset = [], 0
+    for number, text in enumerate(texts, start=1):
+        pages.append({"page": number, "text": text, "start": offset, "end": offset + len(text)})
+        offset += len(text) + 1
+    return pages
+
+
+def _summarize_in_thread(summarizer, pages, previous, timeout=10):
+    result = {}
+    worker = threading.Thread(
+        target=lambda: result.setdefault("parts", list(summarizer.summarize_pages(pages, previous=previous))),
+        daemon=True,
+    )
+    worker.start()
+    worker.join(timeout)
+    assert not worker.is_alive(), "summarize_pages did not return"
+    return result["parts"]
+
+
+def test_reupload_with_first_page_edited_does_not_hang():
+    texts = [f"Page {n} explains topic number {n} in a few plain sentences. It has details." for n in range(1, 13)]
+    first = SemanticSummarizer(api_key=None, max_workers=2, gateway=FakeGateway())
+    _summarize_in_thread(first, _pages(texts), previous=None)
+    assert len(first.chunk_summaries) == 12
+
+    # Version 2: only page 1 changed, pages 2-12 come from `previous` and
+    # queue up behind the open pack holding page 1
+    edited = ["Page 1 was rewritten and now covers a different subject entirely."] + texts[1:]
+    gateway = FakeGateway()
+    second = SemanticSummarizer(api_key=None, max_workers=2, gateway=gateway)
+    parts = _summarize_in_thread(second, _pages(edited), previous=first.chunk_summaries)
+
+    assert len(parts) == 12
+    assert not any(part.startswith("Error:") for part in parts)
+    assert gateway.calls == 1
+
+
+def test_streamed_summaries_count_tokens():
+    gateway = LLMGateway(client=FakeStreamingClient())
+    summarizer = SemanticSummarizer(api_key=None, max_workers=2, gateway=gateway)
+    pages = _pages([f"Page {n} covers topic {n} with a couple of sentences of detail." for n in range(1, 4)])
+    list(summarizer.summarize_stream(pages))
+
+    assert summarizer.requests == 1
+    assert summarizer.total_tokens == 42
+
+
+class FailingReduceGateway(FakeGateway):
+    """Summarizes chunks but fails every merge, like a 429 after the last retry."""
+
+    def chat(self, messages, model, **kwargs):
+        if messages[0]["content"] == REDUCE_SYSTEM_PROMPT:
+            raise RuntimeError("Rate limit reached")
+        return super().chat(messages, model, **kwargs)
+
+
+def test_failed_reduce_is_reported():
+    summarizer = SemanticSummarizer(api_key=None, max_workers=2, gateway=FailingReduceGateway())
+    summarizer.reduce_target_chars = 100
+    parts = [f"## Part {n}\n- A summarized fact about subject number {n}." for n in range(12)]
+
+    summary = summarizer.reduce(parts)
+
+    assert summarizer.reduce_failures > 0
+    assert "subject number 11" in summary
+
+    summarizer.gateway = FakeGateway()
+    summarizer.reduce(parts)
+    assert summarizer.reduce_failures == 0
+
+
+class LockedCache:
+    """LLMResponseCache whose SQLite file another process holds locked."""
+
+    def make_key(self, model, system_prompt, temperature, user_content):
+        return user_content
+
+    def get(self, key):
+        raise sqlite3.OperationalError("database is locked")
+
+    def put(self, key, value):
+        raise sqlite3.OperationalError("database is locked")
+
+
+@pytest.mark.parametrize("pack_tokens", [0, 2000])
+def test_cache_errors_do_not_fail_summaries(pack_tokens):
+    gateway = FakeGateway()
+    summarizer = SemanticSummarizer(
+        api_key=None, max_workers=2, response_cache=LockedCache(), pack_tokens=pack_tokens, gateway=gateway
+    )
+    texts = [f"Page {n} explains topic number {n} in a few plain sentences. It has details." for n in range(1, 5)]
+
+    parts = list(summarizer.summarize_pages(_pages(texts)))
+
+    assert len(parts) == 4
+    assert not any(part.startswith("Error:") for part in parts)
+    assert gateway.calls > 0
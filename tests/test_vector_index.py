@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from vector_index import INDEX_BACKENDS, IndexStore, VectorIndex, build_index, top_k
+
+
+def _corpus(n=2000, dim=64, clusters=40, seed=0):
+    # Unit vectors around a few topics, like chunk embeddings of one corpus
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=n)] + 0.6 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def _queries(vectors, count=50, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), count, replace=False)] + 0.2 * rng.normal(size=(count, vectors.shape[1]))
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _recall(index, exact, queries, k=10):
+    found = 0
+    for query in queries:
+        expected = set(exact.search(query, k)[0].tolist())
+        found += len(expected & set(index.search(query, k)[0].tolist()))
+    return found / (k * len(queries))
+
+
+def test_top_k_is_sorted_best_first():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3], dtype=np.float32)
+    assert top_k(scores, 3).tolist() == [1, 3, 2]
+    assert top_k(scores, 10).tolist() == [1, 3, 2, 4, 0]
+    assert top_k(scores, 0).tolist() == []
+
+
+@pytest.mark.parametrize("backend, minimum", [("int8", 0.95), ("ivf", 0.9)])
+def test_approximate_indexes_agree_with_exact(backend, minimum):
+    vectors = _corpus()
+    exact = build_index(vectors, "exact")
+    index = build_index(vectors, backend)
+    assert len(index) == len(vectors)
+    assert _recall(index, exact, _queries(vectors)) >= minimum
+
+
+@pytest.mark.parametrize("backend", sorted(INDEX_BACKENDS))
+def test_search_respects_mask(backend):
+    vectors = _corpus(n=500)
+    index = build_index(vectors, backend)
+    mask = np.zeros(len(vectors), dtype=bool)
+    mask[::7] = True
+
+    ids, _ = index.search(_queries(vectors, count=1)[0], 10, mask=mask)
+
+    assert len(ids) == 10
+    assert mask[ids].all()
+
+
+@pytest.mark.parametrize("backend", sorted(INDEX_BACKENDS))
+def test_persist_and_reload(tmp_path, backend):
+    vectors = _corpus(n=800)
+    index = build_index(vectors, backend)
+    index.save(str(tmp_path / "index"))
+
+    loaded = VectorIndex.load(str(tmp_path / "index"))
+    assert type(loaded) is type(index)
+    for query in _queries(vectors, count=5):
+        expected_ids, expected_scores = index.search(query, 10)
+        ids, scores = loaded.search(query, 10)
+        assert ids.tolist() == expected_ids.tolist()
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    # A memory-mapped index is read-only on disk but still grows in memory
+    extra = _corpus(n=20, seed=5)
+    loaded.add(extra)
+    assert len(loaded) == 820
+    assert loaded.search(extra[3], 1)[0].tolist() == [803]
+
+
+def test_index_store_keeps_a_bounded_resident_set(tmp_path):
+    store = IndexStore(directory=str(tmp_path), max_resident=2)
+    for key in ("a", "b", "c"):
+        store.put(key, build_index(_corpus(n=50, seed=ord(key))), [key] * 50)
+
+    assert list(store._resident) == ["b", "c"]
+    # Resident copies are the memory-mapped files, not the caller's arrays
+    index, chunks = store.get("c")
+    assert isinstance(index.vectors, np.memmap)
+    assert chunks == ["c"] * 50
+
+    # Evicted from memory, still on disk
+    assert store.get("a") is not None
+    assert list(store._resident) == ["c", "a"]
+    assert store.get("missing") is None
+
+
+def test_index_store_evicts_least_recently_used_on_disk(tmp_path):
+    one_index = 50 * 64 * 4
+    store = IndexStore(directory=str(tmp_path), max_bytes=int(2.5 * one_index))
+    for key in ("a", "b"):
+        store.put(key, build_index(_corpus(n=50, seed=ord(key))), [key] * 50)
+    store.get("a")
+    store.put("c", build_index(_corpus(n=50, seed=3)), ["c"] * 50)
+
+    assert sorted(p.name for p in (tmp_path / "indexes").iterdir()) == ["a", "c"]
+    store.discard("a")
+    assert store.get("a") is None
@@ -0,0 +1,304 @@
+import bisect
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Finished traces are appended to this file, one OTLP/JSON export request per
+# line (the layout of the OpenTelemetry collector's file exporter)
+DEFAULT_TRACE_FILE = os.environ.get("STUDY_BUDDY_TRACE_FILE") or None
+TRACING_ENABLED = os.environ.get("STUDY_BUDDY_TRACING", "1") != "0"
+
+SERVICE_NAME = "study-buddy"
+METRIC_PREFIX = "study_buddy_"
+# Seconds; covers a fast page parse up to a long summary
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current = contextvars.ContextVar("study_buddy_span", default=None)
+
+
+class Span:
+    """One timed operation. Attributes can be added until it ends."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_tracer")
+
+    def __init__(self, tracer, name, parent, attributes, start_ns=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else "%032x" % random.getrandbits(128)
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+        self._tracer = tracer
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None, end_ns=None):
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+        self._tracer._finish(self)
+
+    @property
+    def duration(self):
+        """Seconds, or None while the span is open."""
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e9
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None, end_ns=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Records spans for the hot paths (PDF pages, chunking, LLM calls,
+    embedding batches, search, rendering). Every finished span also feeds a
+    duration histogram in `metrics`, so a slow document can be attributed to
+    PyPDF2, MiniLM or Groq without reading individual traces.
+
+    The current span is kept in a contextvar: spans opened inside another
+    span's `with` block become its children. Work handed to a thread pool
+    keeps its parent when submitted through wrap().
+    """
+
+    def __init__(self, metrics, enabled=TRACING_ENABLED, trace_file=DEFAULT_TRACE_FILE, max_spans=5000):
+        self.metrics = metrics
+        self.enabled = enabled
+        self.trace_file = trace_file
+        # Recently finished spans, for the debug panel and export()
+        self.recent = deque(maxlen=max_spans)
+        self._open = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """Times the block as a child of the current span; yields the Span."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = self.start(name, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    def start(self, name, start_ns=None, **attributes):
+        """
+        Opens a span without making it current, for work that is not one
+        block of code (generators, streams); the caller must call end().
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        span = Span(self, name, _current.get(), attributes, start_ns)
+        with self._lock:
+            self._open[span.trace_id] = self._open.get(span.trace_id, 0) + 1
+        return span
+
+    @contextlib.contextmanager
+    def activate(self, span):
+        """Makes a span opened with start() the current one inside the block."""
+        if span is NOOP_SPAN:
+            yield span
+            return
+        token = _current.set(span)
+        try:
+            yield span
+        finally:
+            _current.reset(token)
+
+    def record(self, name, start_ns, end_ns, **attributes):
+        """Adds an already finished span, e.g. one timed in a worker process."""
+        self.start(name, start_ns=start_ns, **attributes).end(end_ns=end_ns)
+
+    def wrap(self, fn):
+        """
+        Returns fn bound to the current span, to be run on other threads.
+        Each call runs in its own copy of the context, so the wrapper can be
+        passed to executor.map.
+        """
+        context = contextvars.copy_context()
+        return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+    def _finish(self, span):
+        self.metrics.observe("span_duration_seconds", span.duration, span=span.name)
+        if span.error is not None:
+            self.metrics.inc("span_errors_total", span=span.name)
+
+        flush = None
+        with self._lock:
+            self.recent.append(span)
+            if self.trace_file:
+                self._pending.setdefault(span.trace_id, []).append(span)
+            self._open[span.trace_id] -= 1
+            if not self._open[span.trace_id]:
+                del self._open[span.trace_id]
+                flush = self._pending.pop(span.trace_id, None)
+        if flush:
+            self._write(flush)
+
+    def _write(self, spans):
+        try:
+            with open(self.trace_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(otlp_json(spans)) + "\n")
+        except OSError as e:
+            print(f"Trace Export Error: {e}")
+
+    def spans(self):
+        """The recently finished spans, oldest first."""
+        with self._lock:
+            return list(self.recent)
+
+    def export(self, path):
+        """Writes the recently finished spans to path as one OTLP/JSON document."""
+        spans = self.spans()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(otlp_json(spans), f)
+        return len(spans)
+
+    def summary(self):
+        """Per span name: count, total and p95 seconds, errors; slowest total first."""
+        by_name = {}
+        for span in self.spans():
+            by_name.setdefault(span.name, []).append(span)
+        rows = []
+        for name, group in by_name.items():
+            durations = sorted(span.duration for span in group)
+            rows.append({
+                "span": name,
+                "count": len(group),
+                "total_s": round(sum(durations), 3),
+                "p95_s": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 4),
+                "errors": sum(span.error is not None for span in group),
+            })
+        rows.sort(key=lambda row: row["total_s"], reverse=True)
+        return rows
+
+
+class Metrics:
+    """
+    Process-wide Prometheus-style counters and histograms, rendered in the
+    text exposition format by prometheus_text().
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (plus +Inf), sum, count
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            name = METRIC_PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), (counts, total, count) in histograms:
+            name = METRIC_PREFIX + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def otlp_json(spans):
+    """Spans as an OTLP/JSON ExportTraceServiceRequest."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "study_buddy.tracing"},
+                "spans": [_otlp_span(span) for span in spans],
+            }],
+        }]
+    }
+
+
+def _otlp_span(span):
+    record = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        # STATUS_CODE_ERROR / STATUS_CODE_OK
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        record["parentSpanId"] = span.parent_id
+    return record
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+metrics = Metrics()
+tracer = Tracer(metrics)
+span = tracer.span
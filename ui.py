@@ -1,13 +1,18 @@
 import streamlit as st
 import base64
+import hashlib
+import json
 import os
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-from pdf_reader import extract_text_from_pdf
-from summarizer import SemanticSummarizer
-from keywords import ConceptExtractor
+from embeddings import load_model
+from pdf_reader import iter_pdf_pages
 from qa import SemanticQA
+from cache import EmbeddingCache, LLMResponseCache, ResultCache, SemanticAnswerCache
+from vector_index import IndexStore
+from jobs import CANCELLED, DONE, FAILED, JobManager
+from pipeline import run_pipeline
 import time
+import tracing
 
 # --- Load Environment Variables ---
 load_dotenv()
@@ -637,14 +642,28 @@ if 'text' not in st.session_state:
     st.session_state.text = ""
 if 'summary' not in st.session_state:
     st.session_state.summary = ""
+if 'summary_parts' not in st.session_state:
+    st.session_state.summary_parts = []
 if 'keywords' not in st.session_state:
     st.session_state.keywords = []
 if 'history' not in st.session_state:
     st.session_state.history = [] 
 if 'qa_system' not in st.session_state:
     st.session_state.qa_system = None
-if 'filename' not in st.session_state:
-    st.session_state.filename = ""
+if 'file_id' not in st.session_state:
+    st.session_state.file_id = ""
+if 'doc_key' not in st.session_state:
+    st.session_state.doc_key = ""
+if 'chunk_summaries' not in st.session_state:
+    st.session_state.chunk_summaries = {}
+if 'library' not in st.session_state:
+    st.session_state.library = None
+if 'library_history' not in st.session_state:
+    st.session_state.library_history = []
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+if 'job_file_id' not in st.session_state:
+    st.session_state.job_file_id = ""
 
 # --- Helper Functions ---
 def display_pdf(file):
@@ -660,72 +679,226 @@ def display_pdf(file):
     '''
     st.markdown(pdf_display, unsafe_allow_html=True)
 
+def render_history(history):
+    """Renders question/answer pairs as chat bubbles, newest first."""
+    if not history:
+        st.markdown('<div style="text-align:center; opacity: 0.7; font-family: Arial Black; font-size: 1.5rem; margin-top: 50px; color: var(--accent-black); font-weight: 900;">⚡ NO ACTIVE INTERROGATIONS ⚡</div>', unsafe_allow_html=True)
+    else:
+        for q, a in reversed(history):
+            st.markdown(f'<div class="chat-bubble user-bubble">USER QUERY: {q}</div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="chat-bubble ai-bubble">SYSTEM RESPONSE: {a}</div>', unsafe_allow_html=True)
+
+def stream_answer(qa, question, doc_ids=None):
+    """Renders the answer bubble token by token as it streams in; returns the full answer."""
+    st.markdown(f'<div class="chat-bubble user-bubble">USER QUERY: {question}</div>', unsafe_allow_html=True)
+    bubble = st.empty()
+    pieces = []
+    for piece in qa.ask_stream(question, doc_ids=doc_ids):
+        pieces.append(piece)
+        bubble.markdown(f'<div class="chat-bubble ai-bubble">SYSTEM RESPONSE: {"".join(pieces)}</div>', unsafe_allow_html=True)
+    timing = qa.last_timing
+    if timing["ttft"] is not None:
+        st.caption(f"FIRST TOKEN {timing['ttft'] * 1000:.0f} MS / TOTAL {timing['total'] * 1000:.0f} MS")
+    return "".join(pieces)
+
 # --- Resource Loading (Cached) ---
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
 @st.cache_resource
 def load_embedding_model():
+    # Batch size, threads and backend come from STUDY_BUDDY_EMBED_* variables;
+    # with STUDY_BUDDY_EMBED_SOCKET set, server processes share the daemon's model
     with st.spinner("INITIALIZING SYSTEM..."):
-        return SentenceTransformer('all-MiniLM-L6-v2')
+        return load_model(EMBEDDING_MODEL)
 
-# --- UI Layout ---
-st.markdown("# PDF ANALYZER")
-st.markdown("##DOCUMENT INSIGHT SYSTEM")
+# Keyword weight thresholds for the CRITICAL and KEY tiers
+KEYWORD_TIERS = (0.75, 0.45)
+# One optional LLM request to name keyword clusters; off = fully local keywords
+LABEL_KEYWORDS = os.environ.get("STUDY_BUDDY_KEYWORD_LABELS", "") == "1"
 
-uploaded_file = st.file_uploader("UPLOAD SOURCE DOCUMENT", type=['pdf'])
+# Optional local cross-encoder that reranks retrieved chunks,
+# e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANKER_MODEL = os.environ.get("STUDY_BUDDY_RERANKER")
 
-if uploaded_file is not None:
-    current_filename = uploaded_file.name
-    
-    if st.session_state.filename != current_filename:
-        status_placeholder = st.empty()
-        bar = st.progress(0)
-        
-        try:
-            status_placeholder.info("STATUS: READING FILE...")
-            raw_text = extract_text_from_pdf(uploaded_file)
-            
-            if not raw_text:
-                st.error("ERROR: COULD NOT READ TEXT.")
-                st.stop()
+# Sidebar panel with recent spans and metrics, for diagnosing slow documents
+DEBUG_PANEL = os.environ.get("STUDY_BUDDY_DEBUG", "") == "1"
 
-            bar.progress(10)
-            status_placeholder.info("STATUS: LOADING NEURAL NETWORKS...")
-            
-            local_model = load_embedding_model()
-            summarizer = SemanticSummarizer(api_key=api_key)
-            extractor = ConceptExtractor(api_key=api_key)
-            
-            bar.progress(20)
-            status_placeholder.info("STATUS: ANALYZING CONTENT...")
+@st.cache_resource
+def load_reranker():
+    if not RERANKER_MODEL:
+        return None
+    from sentence_transformers import CrossEncoder
 
-            summary = summarizer.summarize(raw_text)
-            
-            bar.progress(70)
-            status_placeholder.info("STATUS: EXTRACTING CONCEPTS...")
+    return CrossEncoder(RERANKER_MODEL)
 
-            keywords = extractor.extract_keywords(summary)
+@st.cache_resource
+def load_result_cache():
+    # A document's index is deleted along with its results
+    return ResultCache(on_evict=load_index_store().discard)
 
-            bar.progress(90)
-            status_placeholder.info("STATUS: PREPARING INTERFACE...")
+@st.cache_resource
+def load_response_cache():
+    return LLMResponseCache()
 
-            qa_system = SemanticQA(local_model, api_key=api_key)
-            qa_system.prepare_context(raw_text)
+@st.cache_resource
+def load_answer_cache():
+    # Paraphrases of a popular question get the first answer (cosine >= threshold)
+    return SemanticAnswerCache(threshold=float(os.environ.get("STUDY_BUDDY_ANSWER_THRESHOLD", 0.9)))
 
-            bar.progress(100)
-            status_placeholder.success("STATUS: SYSTEM ONLINE.")
+@st.cache_resource
+def load_index_store():
+    return IndexStore()
 
-            st.session_state.text = raw_text
-            st.session_state.summary = summary
-            st.session_state.keywords = keywords
-            st.session_state.qa_system = qa_system
-            st.session_state.filename = current_filename
-            st.session_state.history = [] 
-            
-            time.sleep(1)
-            st.rerun() 
+@st.cache_resource
+def load_embedding_cache():
+    model = load_embedding_model()
+    return EmbeddingCache(model.signature, model.dim)
 
-        except Exception as e:
-            status_placeholder.error(f"SYSTEM ERROR: {str(e)}")
+@st.cache_resource
+def load_job_manager():
+    # One worker pool per server process, shared by every session
+    return JobManager()
+
+# --- UI Layout ---
+st.markdown("# PDF ANALYZER")
+st.markdown("##DOCUMENT INSIGHT SYSTEM")
+
+library_mode = st.sidebar.checkbox("LIBRARY MODE", help="Ingest several PDFs and search across all of them.")
+
+embedding_stats = load_embedding_cache().stats()
+st.sidebar.caption(
+    f"EMBEDDING CACHE: {embedding_stats['hit_rate']:.0%} HITS / "
+    f"{embedding_stats['bytes_saved'] / 2**20:.1f} MB SAVED"
+)
+
+if DEBUG_PANEL:
+    with st.sidebar.expander("TRACE"):
+        # Slowest span names first: pdf.* is PyPDF2, embedding.* MiniLM, llm.* Groq
+        st.dataframe(tracing.tracer.summary(), hide_index=True)
+        st.download_button(
+            "OTLP JSON", json.dumps(tracing.otlp_json(tracing.tracer.spans())),
+            file_name="study-buddy-trace.json", mime="application/json",
+        )
+        st.download_button(
+            "METRICS", tracing.metrics.prometheus_text(),
+            file_name="study-buddy-metrics.prom", mime="text/plain",
+        )
+
+# --- LIBRARY MODE: many documents, one shared corpus ---
+if library_mode:
+    uploaded_files = st.file_uploader("UPLOAD SOURCE LIBRARY", type=['pdf'], accept_multiple_files=True)
+
+    if st.session_state.library is None:
+        st.session_state.library = SemanticQA(
+            load_embedding_model(), api_key=api_key, response_cache=load_response_cache(),
+            embedding_cache=load_embedding_cache(), reranker=load_reranker(),
+            answer_cache=load_answer_cache(),
+        )
+    library = st.session_state.library
+
+    for library_file in uploaded_files or []:
+        doc_id = hashlib.sha256(library_file.getvalue()).hexdigest()
+        if doc_id not in library.documents:
+            with st.spinner(f"INDEXING {library_file.name}..."):
+                try:
+                    library.add_document(doc_id, iter_pdf_pages(library_file), title=library_file.name)
+                except ValueError as e:
+                    st.error(f"SYSTEM ERROR: {str(e)}")
+
+    if not library.documents:
+        st.info("⚡ LIBRARY EMPTY - UPLOAD DOCUMENTS TO BEGIN ⚡")
+        st.stop()
+
+    st.divider()
+    st.markdown(f"### LIBRARY: {len(library.documents)} DOCUMENTS / {len(library.context_chunks)} SEGMENTS")
+    selected_docs = st.multiselect(
+        "SEARCH WITHIN:",
+        options=list(library.documents),
+        format_func=lambda doc_id: library.documents[doc_id],
+        placeholder="ALL DOCUMENTS",
+    )
+
+    with st.form("library_q_form", clear_on_submit=True):
+        user_input = st.text_input("ENTER QUERY:", placeholder="ASK ANYTHING ACROSS THE LIBRARY...")
+        submit_button = st.form_submit_button("⚡ EXECUTE QUERY")
+
+    # The new answer streams in above the history instead of after a rerun
+    answered = bool(submit_button and user_input)
+    if answered:
+        answer = stream_answer(library, user_input, doc_ids=selected_docs or None)
+        st.session_state.library_history.append((user_input, answer))
+
+    render_history(st.session_state.library_history[:-1] if answered else st.session_state.library_history)
+    st.stop()
+
+uploaded_file = st.file_uploader("UPLOAD SOURCE DOCUMENT", type=['pdf'])
+
+if uploaded_file is not None:
+    # Every upload gets a new file_id, even when the filename is unchanged
+    if st.session_state.file_id != uploaded_file.file_id:
+        jobs = load_job_manager()
+
+        if st.session_state.job_file_id != uploaded_file.file_id:
+            # New upload: drop any analysis still running for the old one
+            if st.session_state.job_id:
+                jobs.cancel(st.session_state.job_id)
+            st.session_state.job_id = jobs.submit(
+                run_pipeline,
+                uploaded_file.getvalue(),
+                api_key=api_key,
+                embedding_model=load_embedding_model(),
+                embedding_model_name=load_embedding_model().signature,
+                result_cache=load_result_cache(),
+                response_cache=load_response_cache(),
+                index_store=load_index_store(),
+                previous_summaries=st.session_state.chunk_summaries,
+                previous_qa=st.session_state.qa_system,
+                embedding_cache=load_embedding_cache(),
+                reranker=load_reranker(),
+                answer_cache=load_answer_cache(),
+                label_keywords=LABEL_KEYWORDS,
+            )
+            st.session_state.job_file_id = uploaded_file.file_id
+
+        job = jobs.get(st.session_state.job_id)
+        if job is None:
+            # Expired before this session collected it: start over
+            st.session_state.job_file_id = ""
+            st.rerun()
+
+        if job.status == DONE:
+            result = job.result
+            if result["doc_key"] != st.session_state.doc_key:
+                st.session_state.text = result["text"]
+                st.session_state.summary = result["summary"]
+                st.session_state.summary_parts = result["summary_parts"]
+                st.session_state.keywords = result["keywords"]
+                st.session_state.qa_system = result["qa_system"]
+                st.session_state.chunk_summaries = result["chunk_summaries"]
+                st.session_state.doc_key = result["doc_key"]
+                st.session_state.history = []
+            # else: same content uploaded again, keep the current session
+            st.session_state.file_id = uploaded_file.file_id
+            st.session_state.job_id = None
+        elif job.status == FAILED:
+            st.error(f"SYSTEM ERROR: {job.error}")
             st.stop()
+        elif job.status == CANCELLED:
+            st.warning("STATUS: ANALYSIS CANCELLED.")
+            st.stop()
+        else:
+            # The work runs in the job; this script run only reports on it
+            st.info(f"STATUS: {job.message}")
+            st.progress(job.progress)
+            # Stages publish as they finish; topics usually arrive long before the summary
+            if "keywords" in job.outputs:
+                st.markdown("**TOPICS:** " + ", ".join(kw for kw, _ in job.outputs["keywords"]))
+            if job.preview:
+                st.markdown(job.preview)
+            if st.button("CANCEL ANALYSIS"):
+                jobs.cancel(job.id)
+            time.sleep(0.5)
+            st.rerun()
 
 if uploaded_file is not None:
     with st.expander(">> VIEW RAW SOURCE DOCUMENT"):
@@ -735,6 +908,8 @@ if uploaded_file is not None:
 if st.session_state.text:
     st.divider()
     
+    render_span = tracing.tracer.start("ui.render", summary_chars=len(st.session_state.summary or ""))
+
     # --- BRUTALIST TAB STRUCTURE ---
     tab1, tab2, tab3 = st.tabs(["⚡ SUMMARY", "⚡ KEY TOPICS", "⚡ INTERROGATE"])
     
@@ -745,6 +920,14 @@ if st.session_state.text:
                 st.markdown('<div class="summary-card">', unsafe_allow_html=True)
                 st.markdown(st.session_state.summary, unsafe_allow_html=False)
                 st.markdown('</div>', unsafe_allow_html=True)
+
+            # Drill-down: the per-chunk summaries the condensed one was built from,
+            # one at a time so long documents don't render hundreds of sections
+            parts = st.session_state.summary_parts
+            if len(parts) > 1:
+                with st.expander(f">> DRILL DOWN: {len(parts)} SECTION SUMMARIES"):
+                    index = st.number_input("SECTION", min_value=1, max_value=len(parts), value=1)
+                    st.markdown(parts[index - 1], unsafe_allow_html=False)
         else:
             st.info("⚡ NO SUMMARY AVAILABLE")
 
@@ -753,19 +936,23 @@ if st.session_state.text:
         st.markdown("### SYSTEM ANALYSIS COMPLETE")
         st.markdown("###")
         if st.session_state.keywords:
-            # Render first 2 as Critical
+            # Tier by weight (1.0 = strongest topic in the document)
             st.markdown('<div class="kw-grid">', unsafe_allow_html=True)
-            for i, kw in enumerate(st.session_state.keywords[:2]):
-                st.markdown(f'<span class="kw-tier-1">CRITICAL: {kw}</span>', unsafe_allow_html=True)
-            
-            # Render remaining as Standard
-            for kw in st.session_state.keywords[2:]:
-                st.markdown(f'<span class="kw-standard">TOPIC: {kw}</span>', unsafe_allow_html=True)
+            for kw, weight in st.session_state.keywords:
+                if weight >= KEYWORD_TIERS[0]:
+                    st.markdown(f'<span class="kw-tier-1">CRITICAL: {kw}</span>', unsafe_allow_html=True)
+                elif weight >= KEYWORD_TIERS[1]:
+                    st.markdown(f'<span class="kw-tier-2">KEY: {kw}</span>', unsafe_allow_html=True)
+                else:
+                    st.markdown(f'<span class="kw-standard">TOPIC: {kw}</span>', unsafe_allow_html=True)
             
             st.markdown('</div>', unsafe_allow_html=True)
         else:
             st.info("⚡ NO TOPICS EXTRACTED")
 
+    # Answer streaming is traced separately (qa.ask)
+    render_span.end()
+
     # TAB 3: INTERROGATE
     with tab3:
         st.markdown("### DOCUMENT INTERROGATION")
@@ -774,20 +961,15 @@ if st.session_state.text:
             user_input = st.text_input("ENTER QUERY:", placeholder="ASK ANYTHING ABOUT THE DOCUMENT...")
             submit_button = st.form_submit_button("⚡ EXECUTE QUERY")
         
-        if submit_button and user_input:
-            if st.session_state.qa_system:
-                answer = st.session_state.qa_system.ask(user_input)
-                st.session_state.history.append((user_input, answer))
-                st.rerun() 
+        # The new answer streams in above the history instead of after a rerun
+        answered = bool(submit_button and user_input and st.session_state.qa_system)
+        if answered:
+            answer = stream_answer(st.session_state.qa_system, user_input)
+            st.session_state.history.append((user_input, answer))
 
         chat_container = st.container()
         with chat_container:
-            if not st.session_state.history:
-                st.markdown('<div style="text-align:center; opacity: 0.7; font-family: Arial Black; font-size: 1.5rem; margin-top: 50px; color: var(--accent-black); font-weight: 900;">⚡ NO ACTIVE INTERROGATIONS ⚡</div>', unsafe_allow_html=True)
-            else:
-                for q, a in reversed(st.session_state.history):
-                    st.markdown(f'<div class="chat-bubble user-bubble">USER QUERY: {q}</div>', unsafe_allow_html=True)
-                    st.markdown(f'<div class="chat-bubble ai-bubble">SYSTEM RESPONSE: {a}</div>', unsafe_allow_html=True)
+            render_history(st.session_state.history[:-1] if answered else st.session_state.history)
 
 else:
     st.info("⚡ SYSTEM READY - UPLOAD DOCUMENT TO BEGIN ⚡")
\ No newline at end of file
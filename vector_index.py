@@ -0,0 +1,360 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from cache import DEFAULT_CACHE_DIR, evict_lru
+
+# Indexes an IndexStore keeps mapped per process
+DEFAULT_RESIDENT_INDEXES = int(os.environ.get("STUDY_BUDDY_RESIDENT_INDEXES", 32))
+
+
+def top_k(scores, k):
+    """
+    Returns the indices of the k highest scores, best first.
+
+    Uses argpartition so only the k winners are sorted instead of the whole
+    score vector.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def _as_query(query):
+    return np.asarray(query, dtype=np.float32).reshape(-1)
+
+
+def _masked_top_k(scores, k, mask):
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    ids = top_k(scores, k)
+    ids = ids[np.isfinite(scores[ids])]
+    return ids, scores[ids]
+
+
+class VectorIndex:
+    """Base class for the similarity indexes used by SemanticQA."""
+
+    kind = None
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def search(self, query, k, mask=None):
+        """
+        Returns (ids, scores) of the k nearest vectors by dot product.
+
+        Args:
+            query: 1-D query vector.
+            k (int): Number of neighbours to return.
+            mask: Optional boolean array over ids; False entries are skipped.
+        """
+        raise NotImplementedError
+
+    def add(self, embeddings):
+        """Appends vectors; they receive the next consecutive ids."""
+        raise NotImplementedError
+
+    def _arrays(self):
+        raise NotImplementedError
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self._arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"kind": self.kind, "params": self._params()}, f)
+
+    def _params(self):
+        return {}
+
+    @staticmethod
+    def load(directory, mmap=True):
+        with open(os.path.join(directory, "index.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        cls = INDEX_BACKENDS[meta["kind"]]
+        mode = "r" if mmap else None
+        arrays = {
+            entry.name[:-4]: np.load(entry.path, mmap_mode=mode)
+            for entry in os.scandir(directory)
+            if entry.name.endswith(".npy")
+        }
+        return cls._from_arrays(arrays, **meta["params"])
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force float32 matrix. Memory-mapped when loaded from disk."""
+
+    kind = "exact"
+
+    def __init__(self, embeddings):
+        self.vectors = np.asarray(embeddings, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query, k, mask=None):
+        return _masked_top_k(self.vectors @ _as_query(query), k, mask)
+
+    def add(self, embeddings):
+        self.vectors = np.vstack([self.vectors, np.asarray(embeddings, dtype=np.float32)])
+
+    def _arrays(self):
+        return {"vectors": self.vectors}
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        index.vectors = arrays["vectors"]
+        return index
+
+
+class Int8Index(VectorIndex):
+    """
+    Scalar-quantized index: each vector is stored as int8 with its own
+    float32 scale, a quarter of the memory of ExactIndex.
+    """
+
+    kind = "int8"
+
+    def __init__(self, embeddings):
+        self.codes, self.scales = self._quantize(embeddings)
+
+    @staticmethod
+    def _quantize(embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.empty(0)
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+    def __len__(self):
+        return len(self.codes)
+
+    def search(self, query, k, mask=None):
+        return _masked_top_k((self.codes @ _as_query(query)) * self.scales, k, mask)
+
+    def add(self, embeddings):
+        codes, scales = self._quantize(embeddings)
+        self.codes = np.vstack([self.codes, codes])
+        self.scales = np.concatenate([self.scales, scales])
+
+    def _arrays(self):
+        return {"codes": self.codes, "scales": self.scales}
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        index.codes = arrays["codes"]
+        index.scales = arrays["scales"]
+        return index
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file index: vectors are clustered around nlist k-means
+    centroids and a query only scans the nprobe closest clusters.
+    Vectors are stored grouped by cluster so each probe is one contiguous
+    slice.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, embeddings, nlist=None, nprobe=16, iterations=10, seed=0):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        n = len(vectors)
+        if nlist is None:
+            nlist = max(1, int(np.sqrt(n)))
+        nlist = max(1, min(nlist, n))
+        self.nprobe = nprobe
+
+        self.centroids = self._train(vectors, nlist, iterations, seed)
+        self._layout(vectors, np.arange(n, dtype=np.int64), self._assign(vectors))
+
+    def _assign(self, vectors):
+        if not len(vectors):
+            return np.empty(0, dtype=np.int64)
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def _layout(self, vectors, ids, assignments):
+        order = np.argsort(assignments, kind="stable")
+        self.ids = ids[order]
+        self.vectors = vectors[order]
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    @staticmethod
+    def _train(vectors, nlist, iterations, seed):
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+        if len(vectors) == 0:
+            return np.zeros((1, dim), dtype=np.float32)
+
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > 256 * nlist:
+            sample = vectors[rng.choice(len(vectors), 256 * nlist, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        # Spherical k-means: assign by dot product, re-normalize the means
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+        return centroids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k, mask=None):
+        query = _as_query(query)
+        probes = top_k(self.centroids @ query, self.nprobe)
+        candidates = np.concatenate(
+            [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes]
+        ) if len(probes) else np.empty(0, dtype=np.int64)
+
+        if mask is not None:
+            candidates = candidates[mask[self.ids[candidates]]]
+            # A narrow filter can leave the probed lists nearly empty; the
+            # allowed subset is then small enough to scan directly
+            if len(candidates) < k:
+                candidates = np.flatnonzero(mask[self.ids])
+
+        scores = self.vectors[candidates] @ query
+        best = top_k(scores, k)
+        return self.ids[candidates[best]], scores[best]
+
+    def add(self, embeddings):
+        new = np.asarray(embeddings, dtype=np.float32)
+        old_assignments = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+        new_ids = np.arange(len(self), len(self) + len(new), dtype=np.int64)
+        self._layout(
+            np.vstack([self.vectors, new]),
+            np.concatenate([self.ids, new_ids]),
+            np.concatenate([old_assignments, self._assign(new)]),
+        )
+
+    def _arrays(self):
+        return {
+            "centroids": self.centroids,
+            "vectors": self.vectors,
+            "ids": self.ids,
+            "offsets": self.offsets,
+        }
+
+    def _params(self):
+        return {"nprobe": self.nprobe}
+
+    @classmethod
+    def _from_arrays(cls, arrays, nprobe=16):
+        index = cls.__new__(cls)
+        index.centroids = arrays["centroids"]
+        index.vectors = arrays["vectors"]
+        index.ids = arrays["ids"]
+        index.offsets = arrays["offsets"]
+        index.nprobe = nprobe
+        return index
+
+
+INDEX_BACKENDS = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+    "int8": Int8Index,
+}
+
+
+def build_index(embeddings, backend="exact", **kwargs):
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend: {backend}")
+    return INDEX_BACKENDS[backend](embeddings, **kwargs)
+
+
+class IndexStore:
+    """
+    Persists indexes (plus their chunk texts) on disk keyed by document
+    hash, and keeps memory-mapped copies of the max_resident most recently
+    used ones so every session asking about the same document shares it.
+    The least recently used indexes are deleted once the directory exceeds
+    max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=1024 * 1024 * 1024,
+                 max_resident=DEFAULT_RESIDENT_INDEXES):
+        self.directory = os.path.join(directory, "indexes")
+        self.max_bytes = max_bytes
+        self.max_resident = max_resident
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            path = os.path.join(self.directory, key)
+            if key in self._resident:
+                self._resident.move_to_end(key)
+                shared = self._resident[key]
+            else:
+                shared = self._load(path)
+                if shared is None:
+                    return None
+                self._remember(key, shared)
+
+        # Touch the entry so eviction sees it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return shared
+
+    def put(self, key, index, chunks):
+        tmp = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        try:
+            index.save(tmp)
+            with open(os.path.join(tmp, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump(list(chunks), f)
+
+            path = os.path.join(self.directory, key)
+            with self._lock:
+                shutil.rmtree(path, ignore_errors=True)
+                os.replace(tmp, path)
+                # Keep the memory-mapped reload rather than the caller's
+                # in-RAM copy, so the resident set is backed by the page cache
+                shared = self._load(path)
+                if shared is not None:
+                    self._remember(key, shared)
+                for name in evict_lru(self.directory, self.max_bytes):
+                    self._resident.pop(name, None)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def discard(self, key):
+        """Deletes the index for key, e.g. when its ResultCache entry is evicted."""
+        with self._lock:
+            self._resident.pop(key, None)
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(os.path.join(path, "chunks.json"), encoding="utf-8") as f:
+                chunks = json.load(f)
+            return VectorIndex.load(path), chunks
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _remember(self, key, shared):
+        self._resident[key] = shared
+        self._resident.move_to_end(key)
+        while len(self._resident) > self.max_resident:
+            self._resident.popitem(last=False)